@@ -0,0 +1,314 @@
+"""
+HTTP API แบบ headless (ไม่ผ่าน Streamlit) สำหรับระบบอื่น / load balancer
+
+    python api_server.py --port 8080 --workers 4
+
+- GET  /health
+- GET  /retrieve?q=...&top_k=3&stone_type=granite   (หรือ POST {"query": ...} / {"queries": [...]})
+- POST /chat  {"message": "...", "history": [{"role": "user", "content": "..."}], "mode": "rag"|"full"}
+- GET  /stats
+
+ทุก response มี header Server-Timing / X-Response-Time-Ms (เวลาแยกตามขั้นตอน)
+kill -HUP <pid> = build index ของ retriever ใหม่แล้วสลับแบบ hot-swap (ทุก worker, ไม่หยุดรับ request)
+--workers N = 1 process ต่อ core ใช้ port เดียวกัน (SO_REUSEPORT) โดย index ถูกโหลดก่อน fork
+(หรือรันผ่าน gunicorn: gunicorn api_server:create_app --worker-class aiohttp.GunicornWebWorker -w N)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import chat_service
+import resources
+from conversation import Conversation
+from resources import MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+MAX_TOP_K = 50
+MAX_BATCH = 1000
+KEEPALIVE_TIMEOUT = float(os.getenv("API_KEEPALIVE_TIMEOUT", 75))
+
+
+# ==========================================================
+# HELPERS
+# ==========================================================
+class Timer:
+    """เก็บเวลาแต่ละขั้นตอนของ request ไว้ใส่ใน Server-Timing"""
+
+    def __init__(self, request: web.Request):
+        self.timings = request["timings"]
+
+    def stage(self, name: str):
+        timings = self.timings
+
+        class _Stage:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timings[name] = timings.get(name, 0.0) + (time.perf_counter() - self.start) * 1000
+
+        return _Stage()
+
+
+def error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": message}, status=status, dumps=_dumps)
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _records(df) -> list[dict]:
+    # to_json จัดการ NaN -> null และชนิดของ numpy ให้เอง
+    df = df.drop(columns=["combined_text"], errors="ignore")
+    return json.loads(df.to_json(orient="records", force_ascii=False))
+
+
+async def _params(request: web.Request) -> dict:
+    params = dict(request.query)
+    if request.method == "POST" and request.can_read_body:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError("body ต้องเป็น JSON object")
+        params.update(body)
+    return params
+
+
+def _scalar(params: dict, name: str, cast, default=None):
+    """ค่าเดี่ยวจาก query string / JSON body แปลงด้วย cast (list/object/รูปแบบผิด -> ValueError = 400)"""
+    value = params.get(name)
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"{name} ต้องเป็นค่าเดี่ยว ไม่ใช่ list/object")
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError(f"{name} ไม่ถูกต้อง: {value!r}") from None
+
+
+@web.middleware
+async def timing_middleware(request: web.Request, handler):
+    request["timings"] = {}
+    start = time.perf_counter()
+    try:
+        resp = await handler(request)
+    except web.HTTPException as e:
+        resp = error(e.status, e.reason)
+    except (ValueError, json.JSONDecodeError) as e:
+        resp = error(400, str(e))
+    except Exception:
+        # ไม่ให้ aiohttp ตอบ 500 เปล่า ๆ (ไม่มี header เวลา)
+        logger.exception("Unhandled error on %s %s", request.method, request.path)
+        resp = error(500, "internal server error")
+
+    total = (time.perf_counter() - start) * 1000
+    stages = [f"{name};dur={ms:.2f}" for name, ms in request["timings"].items()]
+    resp.headers["Server-Timing"] = ", ".join(stages + [f"total;dur={total:.2f}"])
+    resp.headers["X-Response-Time-Ms"] = f"{total:.2f}"
+    resp.headers["X-Worker-Pid"] = str(os.getpid())
+    return resp
+
+
+# ==========================================================
+# HANDLERS
+# ==========================================================
+async def health(request: web.Request) -> web.Response:
+    retriever = resources.get_retriever()
+    return web.json_response({"status": "ok", "pid": os.getpid(), "catalog_version": retriever.version})
+
+
+async def retrieve(request: web.Request) -> web.Response:
+    params = await _params(request)
+    top_k = max(1, min(_scalar(params, "top_k", int, 3), MAX_TOP_K))
+    stone_type = _scalar(params, "stone_type", str) or None
+    mmr_lambda = _scalar(params, "mmr_lambda", float)
+    retriever = resources.get_retriever()
+    timer = Timer(request)
+
+    # retrieval เป็นงาน CPU สั้น ๆ (cache hit ~µs) รันบน loop ตรง ๆ, scale ด้วยจำนวน worker
+    queries = params.get("queries")
+    if queries is not None:
+        if not isinstance(queries, list) or len(queries) > MAX_BATCH:
+            return error(400, f"queries ต้องเป็น list ไม่เกิน {MAX_BATCH} รายการ")
+        with timer.stage("retrieve"):
+            frames = retriever.retrieve_stones_batch(
+                [str(q) for q in queries], top_k=top_k, stone_type=stone_type, mmr_lambda=mmr_lambda
+            )
+        with timer.stage("serialize"):
+            body = {"results": [_records(df) for df in frames], "catalog_version": retriever.version}
+        return web.json_response(body, dumps=_dumps)
+
+    query = (_scalar(params, "q", str) or _scalar(params, "query", str) or "").strip()
+    if not query:
+        return error(400, "ต้องระบุ q หรือ query")
+    with timer.stage("retrieve"):
+        df = retriever.retrieve_stones(query, top_k=top_k, stone_type=stone_type, mmr_lambda=mmr_lambda)
+    with timer.stage("serialize"):
+        body = {"query": query, "results": _records(df), "catalog_version": retriever.version}
+    return web.json_response(body, dumps=_dumps)
+
+
+def _conversation_from(history) -> Conversation:
+    conv = Conversation()
+    for m in history or []:
+        if not isinstance(m, dict) or m.get("role") not in ("user", "assistant"):
+            raise ValueError("history ต้องเป็น list ของ {role: user|assistant, content: ...}")
+        content = str(m.get("content", ""))
+        refs = chat_service.stone_refs(content) if m["role"] == "assistant" else None
+        conv.add(m["role"], content, refs=refs)
+    return conv
+
+
+async def chat(request: web.Request) -> web.Response:
+    client = request.app["gemini_client"]
+    if client is None:
+        return error(503, "ไม่พบ GEMINI_API_KEY")
+
+    params = await _params(request)
+    message = str(params.get("message", "")).strip()
+    if not message:
+        return error(400, "ต้องระบุ message")
+    use_rag = params.get("mode", chat_service.CONTEXT_MODE) != "full"
+    timer = Timer(request)
+
+    conv = _conversation_from(params.get("history"))
+    with timer.stage("context"):
+        # retrieval + prefix cache (อาจเรียก API ของ Gemini) -> ทำใน thread ไม่บล็อก loop
+        turn = await asyncio.to_thread(
+            chat_service.prepare_turn, message, history=conv.history_text(), pinned=conv.last_refs(),
+            use_rag=use_rag, prefix_cache=request.app["prefix_cache"],
+        )
+    if turn is None:
+        return error(503, chat_service.NO_CATALOG_MESSAGE)
+
+    response_cache = request.app["response_cache"]
+    with timer.stage("cache"):
+        answer = await asyncio.to_thread(response_cache.get, turn.cache_key)
+    cached = answer is not None
+    if not cached:
+        with timer.stage("llm"):
+            try:
+                answer = await client.generate(turn.prompt, turn.model)
+            except Exception as e:
+                logger.warning("Gemini call failed: %s", e)
+                return error(502, f"ระบบ AI มีปัญหาชั่วคราว: {e}")
+        await asyncio.to_thread(response_cache.put, turn.cache_key, MODEL_NAME, answer)
+
+    return web.json_response(
+        {
+            "answer": answer,
+            "cached": cached,
+            "refs": chat_service.stone_refs(answer),
+            "products": [p["title"] for p in turn.context.products],
+            "context_version": turn.context.version,
+        },
+        dumps=_dumps,
+    )
+
+
+async def stats(request: web.Request) -> web.Response:
+    client = request.app["gemini_client"]
+    body = {
+        "pid": os.getpid(),
+        "resources": await asyncio.to_thread(resources.memory_report),
+        "retriever_cache": resources.get_retriever().cache_stats(),
+        "response_cache": request.app["response_cache"].stats(),
+        "coalesced_llm_calls": client.coalesced if client is not None else 0,
+    }
+    return web.json_response(body, dumps=_dumps)
+
+
+# ==========================================================
+# APP
+# ==========================================================
+def warm_up() -> None:
+    """โหลด catalog + index ทั้งหมดไว้ก่อนรับ request (เรียกก่อน fork ให้ทุก worker ใช้ของที่โหลดแล้ว)"""
+    from product_context import get_product_index
+
+    resources.get_retriever().catalog
+    ctx = resources.get_catalog(compact=chat_service.CONTEXT_COMPACT)
+    if ctx.products:
+        get_product_index(ctx)
+
+
+async def _on_startup(app: web.Application) -> None:
+    await asyncio.to_thread(warm_up)
+    # SIGHUP -> StoneRetriever.reload() ใน thread แล้วสลับ, request ระหว่างนั้นยังใช้ catalog เดิม
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, resources.reload_retriever)
+
+
+def create_app() -> web.Application:
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY")
+
+    app = web.Application(middlewares=[timing_middleware])
+    # client ถูกใช้บน event loop ของ worker นี้เท่านั้น (semaphore / rate limit ผูกกับ loop นี้)
+    app["gemini_client"] = resources.get_gemini_client(api_key) if api_key else None
+    app["prefix_cache"] = resources.get_prefix_cache() if api_key else None
+    app["response_cache"] = resources.get_response_cache()
+    app.on_startup.append(_on_startup)
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/retrieve", retrieve)
+    app.router.add_post("/retrieve", retrieve)
+    app.router.add_post("/chat", chat)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def _serve(host: str, port: int, reuse_port: bool) -> None:
+    web.run_app(
+        create_app(), host=host, port=port, reuse_port=reuse_port,
+        keepalive_timeout=KEEPALIVE_TIMEOUT, access_log=None, print=None,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="AI Stone Advisor HTTP API")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", os.cpu_count() or 1)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    warm_up()
+    logger.info("Serving on %s:%s with %d worker(s)", args.host, args.port, args.workers)
+
+    if args.workers <= 1:
+        _serve(args.host, args.port, reuse_port=False)
+        return
+
+    # fork หลัง warm_up: catalog / index ที่โหลดแล้วถูกแชร์แบบ copy-on-write
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_serve, args=(args.host, args.port, True), daemon=True) for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+    # SIGTERM จาก process manager -> ปิด worker ทุกตัวด้วย ไม่ให้ค้างเป็น orphan
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # SIGHUP ที่ process หลัก -> ส่งต่อให้ทุก worker reload เอง
+    signal.signal(signal.SIGHUP, lambda *_: [os.kill(w.pid, signal.SIGHUP) for w in workers if w.is_alive()])
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.join()
+
+
+if __name__ == "__main__":
+    main()
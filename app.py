@@ -1,12 +1,16 @@
 import os
 import time
-import csv
-import random
 
 import streamlit as st
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+import resources
+from chat_service import (
+    CONTEXT_MODE, CONTEXT_TOKEN_BUDGET, NO_CATALOG_MESSAGE, RAG_TOP_N, prepare_turn, stone_refs,
+)
+from conversation import Conversation
+from resources import MODEL_NAME
+
 # ==========================================================
 # PAGE CONFIG + CSS
 # ==========================================================
@@ -130,87 +134,78 @@ if not api_key:
     st.error("ไม่พบ GEMINI_API_KEY (ใน Secrets หรือ .env) ทำงานต่อไม่ได้", icon="🚨")
     st.stop()
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel("models/gemini-2.0-flash")
+# client / cache / catalog สร้างครั้งเดียวต่อ process (resources.py) ไม่ใช่ทุก rerun
+gemini_client = resources.get_gemini_client(api_key)
 
-BASE_DIR = os.path.dirname(__file__)
-CSV_PATH = os.path.join(BASE_DIR, "siamtak_granite.csv")  # ใช้ไฟล์ scrape ของมึง
+response_cache = resources.get_response_cache()  # SQLite, ใช้ร่วมกันทุก session + อยู่ข้าม restart
+# prefix คงที่ (บทบาท + catalog + วิธีตอบ) ถูก cache ไว้, แต่ละรอบส่งแค่คำถาม (GEMINI_CONTEXT_CACHE)
+prefix_cache = resources.get_prefix_cache()
 
 # ==========================================================
 # SESSION STATE
 # ==========================================================
-if "messages" not in st.session_state:
-    st.session_state.messages = []  # [{"role": "user"/"assistant", "content": "..."}]
+RENDER_PAGE = 20  # render ประวัติแชทครั้งละกี่ข้อความ (ที่เก่ากว่านั้นกดโหลดเพิ่มเอง)
+
+if "conversation" not in st.session_state:
+    # ประวัติแชทแบบจำกัดขนาด: window ล่าสุด + สรุป + หินที่อ้างถึง
+    st.session_state.conversation = Conversation(
+        window_turns=int(os.getenv("CHAT_WINDOW_TURNS", 3)),
+        max_messages=int(os.getenv("CHAT_MAX_MESSAGES", 100)),
+    )
+if "render_limit" not in st.session_state:
+    st.session_state.render_limit = RENDER_PAGE
 if "prefill" not in st.session_state:
     st.session_state.prefill = ""
 
 # ==========================================================
 # HELPERS
 # ==========================================================
-def load_products_context() -> str:
-    """
-    โหลดข้อมูลหินจาก siamtak_granite.csv
-    รวมเป็นข้อความยาว ๆ ให้ Gemini ใช้เป็น knowledge
-    """
-    if not os.path.exists(CSV_PATH):
-        return ""
-
-    lines: list[str] = []
-    with open(CSV_PATH, "r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            title = (row.get("product_title") or "").strip()
-            desc = (row.get("product_description") or "").strip()
-            price = (row.get("product_price") or "").strip().replace(",", "")
-
-            if not title:
-                continue
-
-            lines.append(
-                f"- ชื่อ: {title} | ราคา: {price} บาท/ตร.ม. | รายละเอียด: {desc}"
-            )
-
-    if not lines:
-        return ""
-
-    block = "\n".join(lines)
-
-    context = (
-        "คุณเป็นผู้เชี่ยวชาญด้านหินแกรนิตและงานตกแต่งภายในของโชว์รูมหินในประเทศไทย\n"
-        "ต่อไปนี้คือรายการหินแกรนิตทั้งหมดที่มีอยู่ในระบบ (ข้อมูลจริงจากไฟล์ CSV):\n"
-        f"{block}\n\n"
-        "ให้คุณใช้ข้อมูลด้านบนในการแนะนำลูกค้าเท่านั้น ห้ามสร้างชื่อหินหรือราคาขึ้นมาเอง\n"
-    )
-    return context
+UI_UPDATE_INTERVAL = 0.1  # วินาที: อัปเดต UI เป็นช่วง ๆ ไม่ใช่ทุก chunk
 
 
-def stream_chat_markdown(text: str):
-    """ให้ assistant พิมพ์แบบค่อย ๆ ขึ้นเหมือน ChatGPT"""
+def stream_chat_markdown(chunks, interval: float = UI_UPDATE_INTERVAL) -> str:
+    """แสดงคำตอบ assistant ตามที่ Gemini stream มาจริง (อัปเดต UI ทุก interval วินาที) คืนข้อความเต็ม"""
     container = st.chat_message("assistant")
     placeholder = container.empty()
 
     rendered = ""
-    for chunk in text.split(" "):  # พิมพ์ทีละคำ
-        rendered += chunk + " "
-        placeholder.markdown(rendered)
-        time.sleep(0.03)
+    last_update = 0.0
+    for chunk in chunks:
+        rendered += chunk
+        now = time.monotonic()
+        if now - last_update >= interval:
+            placeholder.markdown(rendered + "▌")
+            last_update = now
     placeholder.markdown(rendered)
+    return rendered
 
 
-def call_gemini_with_retry(prompt: str, max_retries: int = 3) -> str:
-    for attempt in range(max_retries):
-        try:
-            resp = model.generate_content(prompt)
-            return resp.text or ""
-        except Exception as e:
-            msg = str(e)
-            is_429 = ("429" in msg) or ("Resource exhausted" in msg)
-            if is_429 and attempt < max_retries - 1:
-                # backoff เบา ๆ กันโดน spam
-                time.sleep((2 ** attempt) + random.random())
-                continue
-            return f"ขออภัย ระบบ AI มีปัญหาชั่วคราว: {e}"
-    return "ขออภัย ระบบ AI ตอบไม่ได้ในตอนนี้"
+def stream_gemini_with_retry(prompt: str, cache_key: str | None = None, model=None):
+    """
+    generator ของข้อความจาก Gemini แบบ stream จริง (chunk แรกมาถึงเร็วกว่ารอคำตอบเต็ม)
+    - cache hit -> ส่งคำตอบเดิมก้อนเดียว
+    - rate limit / retry / timeout อยู่ใน gemini_client (ไม่ sleep บน thread ของ script)
+    - หลาย session ถาม prompt เดียวกันพร้อมกัน -> gemini_client ยิง Gemini ครั้งเดียวแล้วแจกทุกคน
+    - error -> ส่งข้อความขออภัยต่อท้ายแทน (ไม่ cache คำตอบที่ไม่สำเร็จ)
+    """
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts: list[str] = []
+    try:
+        for text in gemini_client.stream_sync(prompt, model):
+            parts.append(text)
+            yield text
+    except Exception as e:
+        prefix = "\n\n" if parts else ""
+        yield f"{prefix}ขออภัย ระบบ AI มีปัญหาชั่วคราว: {e}"
+        return
+    if cache_key:
+        response_cache.put(cache_key, MODEL_NAME, "".join(parts))  # cache เฉพาะตอนสำเร็จ
+
 
 # ==========================================================
 # HERO
@@ -219,7 +214,7 @@ st.markdown(
     """
 <div class="hero">
   <h1 class="hero-title">🪨 AI Stone Advisor</h1>
-  <p>เวอร์ชันใช้ Gemini + CSV จาก siamtak_granite โดยตรง (ไม่ใช้ RAG) — พิมพ์ความต้องการ แล้วระบบจะช่วยเลือกหินให้</p>
+  <p>เวอร์ชันใช้ Gemini + CSV จาก siamtak_granite (คัดเฉพาะหินที่เกี่ยวข้องส่งให้ AI) — พิมพ์ความต้องการ แล้วระบบจะช่วยเลือกหินให้</p>
 </div>
 """,
     unsafe_allow_html=True,
@@ -234,6 +229,22 @@ left, right = st.columns([1, 1], gap="large")
 with left:
     st.subheader("⚙️ ตั้งค่า")
     st.caption("ตอนนี้ demo ใช้เฉพาะหินแกรนิตจากไฟล์ siamtak_granite.csv")
+    use_rag = st.toggle(
+        "ส่งเฉพาะหินที่เกี่ยวข้องให้ AI (RAG)",
+        value=CONTEXT_MODE == "rag",
+        help=f"คัดสูงสุด {RAG_TOP_N} รายการ (~{CONTEXT_TOKEN_BUDGET} tokens) แทนการส่งทั้ง catalog ทุกข้อความ",
+    )
+
+    with st.expander("สถานะระบบ"):
+        # วัดขนาดเฉพาะตอนขอดู (ไล่ object ทั้งก้อน ไม่ควรทำทุก rerun)
+        if st.checkbox("แสดงการใช้ memory ของ resource กลาง"):
+            report = resources.memory_report()
+            for row in report:
+                st.caption(f"{row['name']}: {row['bytes'] / 1024:,.0f} KB (สร้าง {row['build_seconds']:.2f} วิ)")
+            st.caption(f"รวม ~{sum(r['bytes'] for r in report) / 1024 / 1024:,.1f} MB")
+        if st.button("โหลด catalog ใหม่"):
+            # แอปตอบจาก product_context เท่านั้น -> ล้าง context + product index (retriever ของ rag_system ไม่เกี่ยว)
+            resources.invalidate("catalog")
 
 with right:
     st.markdown(
@@ -263,7 +274,17 @@ st.divider()
 # ==========================================================
 # แสดงประวัติแชทเดิม
 # ==========================================================
-for m in st.session_state.messages:
+conversation: Conversation = st.session_state.conversation
+
+# render แค่หน้าล่าสุด (rerun ทุกครั้งไม่ต้องวาดประวัติทั้งหมด)
+hidden, visible_messages = conversation.visible(st.session_state.render_limit)
+if hidden and st.button(f"แสดงข้อความก่อนหน้า ({hidden})"):
+    st.session_state.render_limit += RENDER_PAGE
+    hidden, visible_messages = conversation.visible(st.session_state.render_limit)
+if conversation.dropped and not hidden:
+    st.caption(f"ข้อความเก่า {conversation.dropped} ข้อความถูกย่อเป็นสรุปแล้ว")
+
+for m in visible_messages:
     st.chat_message(m["role"]).markdown(m["content"])
 
 # ==========================================================
@@ -281,43 +302,17 @@ if prefill and not user_input_raw:
     st.session_state.prefill = ""  # ใช้แล้วเคลียร์
 
 if user_input:
-    # เก็บประวัติ
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    # บทสนทนาก่อนหน้า (ก่อนใส่คำถามนี้) ให้ Gemini ตอบคำถามต่อเนื่องได้ เช่น "อันที่สองราคาเท่าไหร่"
+    history = conversation.history_text()
+    conversation.add("user", user_input)
     st.chat_message("user").markdown(user_input)
 
-    # โหลด context จาก CSV
-    context = load_products_context()
-    if not context:
-        msg = "ยังไม่มีข้อมูลหินในระบบ (อ่านไฟล์ siamtak_granite.csv ไม่ได้)"
-        st.chat_message("assistant").write(msg)
-        st.session_state.messages.append({"role": "assistant", "content": msg})
+    turn = prepare_turn(user_input, history=history, pinned=conversation.last_refs(), use_rag=use_rag,
+                        prefix_cache=prefix_cache)
+    if turn is None:
+        st.chat_message("assistant").write(NO_CATALOG_MESSAGE)
+        conversation.add("assistant", NO_CATALOG_MESSAGE)
     else:
-        prompt = f"""
-{context}
-
-ตอนนี้ลูกค้าถามว่า:
-\"\"\"{user_input}\"\"\"
-
-ให้คุณ:
-1) สรุปความต้องการของลูกค้าแบบสั้น ๆ
-2) เลือกหินที่เหมาะสมที่สุด 1–3 แบบ จาก "รายการด้านบนเท่านั้น" (ห้ามสร้างชื่อหินใหม่)
-   - ระบุชื่อหินให้ตรงตามรายการ
-   - ระบุช่วงราคาให้ตรงตามข้อมูล
-3) อธิบายเหตุผล (เรื่องงบประมาณ การใช้งาน พื้น/ผนัง/ครัว ภายใน/ภายนอก สไตล์ ฯลฯ)
-4) บอกข้อดี/ข้อเสียอย่างย่อ และแนะนำการดูแลรักษา
-5) ถ้าไม่มีหินที่อยู่ในงบ ให้บอกตรง ๆ ว่า "ไม่มีในงบ" และแนะนำช่วงงบที่เหมาะสมแทน
-
-ตอบเป็นภาษาไทยทั้งหมด จัดรูปแบบให้อ่านง่ายเป็นหัวข้อ/รายการ
-"""
-
-        answer = call_gemini_with_retry(prompt)
-
-        # แสดงแบบค่อย ๆ พิมพ์
-        stream_chat_markdown(answer)
-        st.session_state.messages.append({"role": "assistant", "content": answer})
-
-
-
-
-
-
+        # stream คำตอบจริงจาก Gemini ขึ้นจอทันทีที่มาถึง
+        answer = stream_chat_markdown(stream_gemini_with_retry(turn.prompt, cache_key=turn.cache_key, model=turn.model))
+        conversation.add("assistant", answer, refs=stone_refs(answer))
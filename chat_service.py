@@ -0,0 +1,84 @@
+import os
+from dataclasses import dataclass
+
+import resources
+from conversation import find_stone_refs
+from product_context import ProductContext, build_retrieval_context
+from resources import MODEL_NAME
+from response_cache import make_cache_key
+
+# context mode: "rag" = ส่งเฉพาะสินค้าที่เกี่ยวข้อง, "full" = ส่งทั้ง catalog แบบเดิม
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "rag")
+RAG_TOP_N = int(os.getenv("RAG_TOP_N", 15))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# "compact" = ตารางย่อจัดกลุ่มตามประเภท/ช่วงราคา, "lines" = 1 บรรทัดเต็มต่อสินค้าแบบเดิม
+CONTEXT_COMPACT = os.getenv("CONTEXT_FORMAT", "compact") == "compact"
+
+NO_CATALOG_MESSAGE = "ยังไม่มีข้อมูลหินในระบบ (อ่านไฟล์ siamtak_granite.csv ไม่ได้)"
+
+ANSWER_GUIDE = """ให้คุณ:
+1) สรุปความต้องการของลูกค้าแบบสั้น ๆ
+2) เลือกหินที่เหมาะสมที่สุด 1–3 แบบ จาก "รายการด้านบนเท่านั้น" (ห้ามสร้างชื่อหินใหม่)
+   - ระบุชื่อหินให้ตรงตามรายการ
+   - ระบุช่วงราคาให้ตรงตามข้อมูล
+3) อธิบายเหตุผล (เรื่องงบประมาณ การใช้งาน พื้น/ผนัง/ครัว ภายใน/ภายนอก สไตล์ ฯลฯ)
+4) บอกข้อดี/ข้อเสียอย่างย่อ และแนะนำการดูแลรักษา
+5) ถ้าไม่มีหินที่อยู่ในงบ ให้บอกตรง ๆ ว่า "ไม่มีในงบ" และแนะนำช่วงงบที่เหมาะสมแทน
+
+ตอบเป็นภาษาไทยทั้งหมด จัดรูปแบบให้อ่านง่ายเป็นหัวข้อ/รายการ
+"""
+
+
+@dataclass(frozen=True)
+class ChatTurn:
+    prompt: str                 # ส่วนที่ส่งใน request นี้
+    model: object | None        # model ที่มี prefix cache อยู่แล้ว (None = model ปกติของ client)
+    cache_key: str              # key ของ response cache
+    context: ProductContext     # context ที่ใช้ตอบ (products = หินที่ถูกส่งให้ AI)
+
+
+def build_prompt(context: str, context_version: str, user_input: str, cacheable: bool, history: str = "",
+                 prefix_cache=None):
+    """
+    คืน (prompt, model): ถ้า prefix cache ใช้ได้ -> prefix อยู่ใน model, prompt เหลือแค่คำถาม
+    ไม่งั้น -> prompt ก้อนเดียวแบบเดิม, model=None (ใช้ model ปกติของ client)
+    history: บทสนทนาก่อนหน้าแบบย่อ (Conversation.history_text) อยู่ในส่วนที่เปลี่ยนทุกรอบ
+    """
+    question = f'{history}ตอนนี้ลูกค้าถามว่า:\n"""{user_input}"""\n'
+    if cacheable and prefix_cache is not None:
+        prefix = f"{context}\nเมื่อลูกค้าถาม {ANSWER_GUIDE}"
+        return question, prefix_cache.model_for(context_version, prefix)
+    return f"\n{context}\n\n{question}\n{ANSWER_GUIDE}", None
+
+
+def prepare_turn(user_input: str, history: str = "", pinned: list[str] | None = None, use_rag: bool = True,
+                 top_n: int = RAG_TOP_N, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 compact: bool = CONTEXT_COMPACT, prefix_cache=None) -> ChatTurn | None:
+    """
+    เตรียม prompt ของ 1 รอบ (ใช้ร่วมกันทั้ง Streamlit และ HTTP API) คืน None ถ้ายังไม่มี catalog
+    """
+    # context จาก CSV (cache ต่อ process, อ่านใหม่เฉพาะตอนไฟล์ถูก scrape ทับ)
+    product_context = resources.get_catalog(compact=compact)
+    if not product_context.text:
+        return None
+
+    if use_rag:
+        # คัดเฉพาะ top-N ที่เกี่ยวข้องกับคำถาม (prompt เล็กลง = เร็วขึ้น + ถูกลง)
+        product_context = build_retrieval_context(
+            product_context, user_input, top_n=top_n, token_budget=token_budget, compact=compact, pinned=pinned,
+        )
+
+    # catalog ทั้งก้อน (ไม่ใช่ RAG) เหมือนกันทุกข้อความ -> ใช้ prefix cache ได้
+    prompt, model = build_prompt(
+        product_context.text, product_context.version, user_input, cacheable=not use_rag, history=history,
+        prefix_cache=prefix_cache,
+    )
+    # คำตอบขึ้นกับบทสนทนาก่อนหน้าด้วย -> history อยู่ใน key
+    cache_key = make_cache_key(MODEL_NAME, product_context.version, history + user_input)
+    return ChatTurn(prompt=prompt, model=model, cache_key=cache_key, context=product_context)
+
+
+def stone_refs(answer: str, compact: bool = CONTEXT_COMPACT) -> list[str]:
+    """ชื่อหินใน catalog ที่คำตอบพูดถึง (เรียงตามที่ปรากฏ)"""
+    titles = [p["title"] for p in resources.get_catalog(compact=compact).products]
+    return find_stone_refs(answer, titles)
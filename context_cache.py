@@ -0,0 +1,109 @@
+import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    """
+    แยก prefix คงที่ (บทบาท + catalog + วิธีตอบ) ออกจากคำถามของแต่ละรอบ
+    model_for(version, text) -> model ที่มี prefix นี้เป็น system instruction อยู่แล้ว
+    สร้างใหม่เฉพาะตอน version เปลี่ยน (ไฟล์ catalog ถูกแก้) หรือเกิน max_age
+
+    แบบ local นี้ไม่ได้ลดขนาดที่ส่งขึ้นไป แต่ใช้แทน GeminiContextCache ตอนทดสอบ/ตอน provider ไม่รองรับ
+    model_factory(**kwargs) -> model (เช่น lambda **kw: genai.GenerativeModel(MODEL_NAME, **kw))
+    """
+
+    def __init__(self, model_factory, max_age: float | None = None):
+        self.model_factory = model_factory
+        self.max_age = max_age
+        self.builds = 0
+
+        self._lock = threading.Lock()
+        self._version: str | None = None
+        self._model = None
+        self._built_at = 0.0
+
+    def _fresh(self, version: str) -> bool:
+        if self._model is None or version != self._version:
+            return False
+        return self.max_age is None or time.monotonic() - self._built_at < self.max_age
+
+    def model_for(self, version: str, text: str):
+        if self._fresh(version):
+            return self._model
+
+        with self._lock:
+            if not self._fresh(version):
+                self._release()
+                self._model = self._build(text)
+                self._version = version
+                self._built_at = time.monotonic()
+                self.builds += 1
+            return self._model
+
+    def _build(self, text: str):
+        return self.model_factory(system_instruction=text)
+
+    def _release(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"version": self._version, "builds": self.builds, "provider": False}
+
+
+class GeminiContextCache(PrefixCache):
+    """
+    ใช้ context caching ของ Gemini: prefix ถูก upload ครั้งเดียวต่อ version แล้วแต่ละรอบส่งแค่คำถาม
+    - สร้าง cache ใหม่ก่อนหมดอายุ (max_age = 90% ของ ttl)
+    - ตัวเก่าไม่ลบทันที (request ที่ถือ model เดิมอาจยังรันอยู่) แค่ลด ttl เหลือ release_grace ให้หมดอายุเอง
+    - prefix สั้นกว่า min_tokens (ขั้นต่ำของ provider) -> ไม่เรียก create เลย ใช้ system instruction ธรรมดา
+    - model ไม่รองรับ / create ล้มเหลว -> fallback แบบเดียวกัน
+    """
+
+    def __init__(self, model_name: str, model_factory, ttl: float = 3600, min_tokens: int = 32768,
+                 release_grace: float = 300):
+        super().__init__(model_factory, max_age=ttl * 0.9)
+        self.model_name = model_name
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.release_grace = release_grace
+        self._cached = None
+
+    def _build(self, text: str):
+        from product_context import estimate_tokens
+
+        tokens = estimate_tokens(text)
+        if tokens < self.min_tokens:
+            logger.info("Prefix ~%d tokens is below the context cache minimum (%d), using system instruction",
+                        tokens, self.min_tokens)
+            return super()._build(text)
+        try:
+            import google.generativeai as genai
+            from google.generativeai import caching
+
+            self._cached = caching.CachedContent.create(
+                model=self.model_name,
+                display_name="stone-catalog",
+                system_instruction=text,
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+            return genai.GenerativeModel.from_cached_content(cached_content=self._cached)
+        except Exception as e:
+            logger.warning("Gemini context cache unavailable, using plain system instruction: %s", e)
+            self._cached = None
+            return super()._build(text)
+
+    def _release(self) -> None:
+        if self._cached is None:
+            return
+        try:
+            self._cached.update(ttl=datetime.timedelta(seconds=self.release_grace))
+        except Exception as e:
+            logger.info("Could not shorten old context cache ttl, it expires on its own: %s", e)
+        self._cached = None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "provider": self._cached is not None}
@@ -0,0 +1,122 @@
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=8)
+def _title_pattern(titles: tuple[str, ...]) -> re.Pattern | None:
+    names = sorted({t for t in titles if t}, key=len, reverse=True)  # ชื่อยาวก่อน (GZT-0005-44 ก่อน GZT-0005)
+    if not names:
+        return None
+    return re.compile("|".join(re.escape(n) for n in names), re.IGNORECASE)
+
+
+def find_stone_refs(text: str, titles: list[str] | tuple[str, ...]) -> list[str]:
+    """ชื่อหินจาก catalog ที่ถูกพูดถึงในข้อความ เรียงตามลำดับที่ปรากฏ (ไม่ซ้ำ)"""
+    pattern = _title_pattern(tuple(titles))
+    if pattern is None or not text:
+        return []
+
+    canonical = {t.lower(): t for t in titles}
+    refs: list[str] = []
+    for m in pattern.finditer(text):
+        name = canonical.get(m.group(0).lower(), m.group(0))
+        if name not in refs:
+            refs.append(name)
+    return refs
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class Conversation:
+    """
+    ประวัติแชทของ 1 session แบบจำกัดขนาด
+    - window_turns: จำนวนรอบ (ถาม+ตอบ) ล่าสุดที่ส่งให้ Gemini แบบเต็ม (ตัดแต่ละข้อความที่ turn_chars)
+    - รอบที่เก่ากว่านั้นถูกย่อเป็นสรุปสั้น ๆ (summary_chars) + รายชื่อหินที่อ้างถึง (max_refs)
+    - max_messages: เก็บข้อความไว้แสดงผลไม่เกินนี้ ที่เก่ากว่าถูกทิ้ง (เหลือแค่ในสรุป)
+    """
+
+    def __init__(self, window_turns: int = 3, max_messages: int = 100, summary_chars: int = 1200,
+                 max_refs: int = 20, turn_chars: int = 600):
+        self.window_turns = window_turns
+        self.max_messages = max_messages
+        self.summary_chars = summary_chars
+        self.max_refs = max_refs
+        self.turn_chars = turn_chars
+
+        self.messages: list[dict] = []   # [{"role": "user"/"assistant", "content": "...", "refs": [...]}]
+        self.summary: list[str] = []     # 1 บรรทัดต่อข้อความที่หลุดจาก window
+        self.refs: list[str] = []        # หินที่ถูกอ้างถึง (เก่า -> ใหม่)
+        self.dropped = 0                 # จำนวนข้อความที่ถูกทิ้งไปแล้ว
+        self._folded = 0                 # ข้อความ [0:_folded] ถูกย่อลง summary แล้ว
+
+    def __len__(self) -> int:
+        return self.dropped + len(self.messages)
+
+    def add(self, role: str, content: str, refs: list[str] | None = None) -> None:
+        self.messages.append({"role": role, "content": content, "refs": refs or []})
+        for r in refs or []:
+            if r in self.refs:
+                self.refs.remove(r)
+            self.refs.append(r)
+        del self.refs[: -self.max_refs]
+        self._fold()
+
+    def _fold(self) -> None:
+        keep = 2 * self.window_turns
+        while len(self.messages) - self._folded > keep:
+            m = self.messages[self._folded]
+            if m["role"] == "user":
+                self.summary.append(f"- ลูกค้าถาม: {_clip(m['content'], 100)}")
+            elif m["refs"]:
+                self.summary.append(f"  แนะนำ: {', '.join(m['refs'])}")
+            else:
+                self.summary.append(f"  ตอบ: {_clip(m['content'], 80)}")
+            self._folded += 1
+
+        while self.summary and sum(len(line) + 1 for line in self.summary) > self.summary_chars:
+            self.summary.pop(0)
+
+        extra = len(self.messages) - self.max_messages
+        if extra > 0:
+            extra = min(extra, self._folded)  # ทิ้งเฉพาะที่อยู่ในสรุปแล้ว
+            del self.messages[:extra]
+            self._folded -= extra
+            self.dropped += extra
+
+    def last_refs(self) -> list[str]:
+        """หินที่คำตอบล่าสุดพูดถึง (ใช้ตอบคำถามต่อเนื่องเช่น "อันที่สอง")"""
+        for m in reversed(self.messages):
+            if m["role"] == "assistant":
+                return m["refs"]
+        return []
+
+    def history_text(self) -> str:
+        """บทสนทนาก่อนหน้าแบบย่อสำหรับใส่ใน prompt ("" ถ้ายังไม่มี)"""
+        if not self.messages:
+            return ""
+
+        parts: list[str] = []
+        if self.summary:
+            parts.append("สรุปบทสนทนาก่อนหน้า:\n" + "\n".join(self.summary))
+        if self.refs:
+            parts.append("หินที่พูดถึงไปแล้ว: " + ", ".join(self.refs))
+        last = self.last_refs()
+        if last:
+            parts.append("หินในคำตอบล่าสุด (ตามลำดับ): " + " ".join(f"{i}) {r}" for i, r in enumerate(last, 1)))
+
+        recent = self.messages[self._folded:]
+        if recent:
+            lines = [
+                f"{'ลูกค้า' if m['role'] == 'user' else 'AI'}: {_clip(m['content'], self.turn_chars)}"
+                for m in recent
+            ]
+            parts.append("ข้อความล่าสุด:\n" + "\n".join(lines))
+        return "\n\n".join(parts) + "\n\n"
+
+    def visible(self, limit: int) -> tuple[int, list[dict]]:
+        """(จำนวนข้อความเก่าที่ยังกดโหลดดูได้, ข้อความล่าสุด limit ตัวที่จะ render)"""
+        shown = self.messages[-limit:] if limit > 0 else []
+        return len(self.messages) - len(shown), shown
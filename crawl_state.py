@@ -0,0 +1,155 @@
+"""
+Persistent crawl state for incremental scraping.
+Stores per-URL validators (ETag / Last-Modified), content hashes and the
+last parsed record in SQLite so reruns can skip unchanged pages and images.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+STATE_PATH = Path(__file__).resolve().parent / ".crawl_state.sqlite3"
+
+
+def content_hasher():
+    """Incremental hasher matching content_hash (for bodies streamed in chunks)."""
+    return hashlib.sha256()
+
+
+def content_hash(data: bytes) -> str:
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+class CrawlState:
+    """SQLite-backed crawl state shared by the scraper worker threads."""
+
+    def __init__(self, path: Path = STATE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    record TEXT,
+                    fetched_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    path TEXT,
+                    fetched_at REAL NOT NULL
+                )
+                """
+            )
+
+    # ------------------------------------------------------------------
+    # pages
+    # ------------------------------------------------------------------
+    def get_page(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, record FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "content_hash": row[2],
+            "record": json.loads(row[3]) if row[3] else None,
+        }
+
+    def put_page(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                 digest: Optional[str], record: Dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, record, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, digest, json.dumps(record, ensure_ascii=False), time.time()),
+            )
+
+    def touch_page(self, url: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def update_record(self, url: str, record: Dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pages SET record = ? WHERE url = ?", (json.dumps(record, ensure_ascii=False), url)
+            )
+
+    def page_urls(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT url FROM pages")]
+
+    def records(self, batch: int = 500) -> Iterator[Dict]:
+        """Last known record of every page, in insertion order (read in batches)."""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT rowid, record FROM pages WHERE record IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch),
+                ).fetchall()
+            if not rows:
+                return
+            for _, record in rows:
+                yield json.loads(record)
+            last = rows[-1][0]
+
+    def remove_pages(self, urls: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pages WHERE url = ?", [(u,) for u in urls])
+
+    # ------------------------------------------------------------------
+    # images
+    # ------------------------------------------------------------------
+    def get_image(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, path FROM images WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2], "path": row[3]}
+
+    def put_image(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                  digest: Optional[str], path: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (url, etag, last_modified, content_hash, path, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, digest, path, time.time()),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+    """If-None-Match / If-Modified-Since headers from a stored state entry."""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
@@ -0,0 +1,265 @@
+"""
+Fast product-page parsing for scrape_granite.py (lxml + precompiled XPath).
+
+extract() runs a compiled extraction spec (h1, og/meta description, the shop's
+product_description / product_price classes first, CDN hero image) and returns
+None when the spec cannot handle a page, so parse_product_html falls back to the
+BeautifulSoup heuristics for that page only.
+
+Benchmark against the BeautifulSoup parser over saved pages:
+
+    python fast_parser.py pages/                # *.html in pages/
+    python fast_parser.py pages/ --fetch 50     # save 50 live product pages first
+"""
+import argparse
+import html
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # optional: without lxml everything goes through BeautifulSoup
+    etree = None
+    lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+# "fast" = lxml spec with BeautifulSoup fallback, "bs4" = BeautifulSoup heuristics only
+BACKENDS = ("fast", "bs4")
+_backend = "fast"
+
+
+def set_backend(name: str) -> None:
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name}")
+    _backend = name
+
+
+def get_backend() -> str:
+    return _backend if available() else "bs4"
+
+
+def available() -> bool:
+    return etree is not None
+
+
+# ---------------------------------------------------------------------------
+# Extraction spec
+# ---------------------------------------------------------------------------
+# Same rules and priority order as scrape_granite.parse_product_html_soup: ("class", x) is
+# a CSS .x class selector, ("contains", x) is [class*="x"]. Each rule list is compiled into
+# one substring-only XPath (cheap in libxml2) that returns a superset of the candidates in
+# a single pass; exact class matching and rule priority (shop classes first) are done here.
+DESCRIPTION_RULES = [
+    ("class", "product_description"),
+    ("class", "product-description"),
+    ("class", "product-details"),
+    ("class", "description"),
+    ("class", "product-content"),
+    ("class", "product-info"),
+    ("contains", "description"),
+    ("contains", "detail"),
+]
+PRICE_RULES = [
+    ("class", "product_discount-price"),
+    ("class", "product_price"),
+    ("class", "price"),
+    ("class", "product-price"),
+    ("class", "current-price"),
+    ("class", "sale-price"),
+    ("contains", "price"),
+]
+MAX_DESCRIPTION_PARTS = 3
+
+HERO_IMAGE_RE = re.compile(r'src="(https://siamtak\.b-cdn\.net/hero-product/[^"]+)"')
+CDN_IMAGE_RE = re.compile(r'src="(https://siamtak\.b-cdn\.net/(?!Main_Structure)[^"]+)"')
+PRICE_RE = re.compile(r'[\d,]+')
+
+
+def _compile(rules):
+    fragments = sorted({name for _, name in rules})
+    # drop fragments implied by a shorter one ("price" covers "product_price")
+    fragments = [f for f in fragments if not any(o != f and o in f for o in fragments)]
+    return etree.XPath("//*[" + " or ".join(f"contains(@class, '{f}')" for f in fragments) + "]")
+
+
+def _matches(rule, classes: str) -> bool:
+    kind, name = rule
+    return name in classes.split() if kind == "class" else name in classes
+
+
+if etree is not None:
+    _TEXT = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+    _H1 = etree.XPath("(//h1)[1]")
+    _META_DESC = etree.XPath("(//meta[@name='description'])[1]/@content")
+    _OG_DESC = etree.XPath("(//meta[@property='og:description'])[1]/@content")
+    _OG_IMAGE = etree.XPath("(//meta[@property='og:image'])[1]/@content")
+    _DESCRIPTION_CANDIDATES = _compile(DESCRIPTION_RULES)
+    _PRICE_CANDIDATES = _compile(PRICE_RULES)
+
+
+def _strings(elem) -> List[str]:
+    return [s.strip() for s in _TEXT(elem) if s.strip()]
+
+
+def _descriptions(root) -> List[str]:
+    candidates = [(elem, elem.get("class")) for elem in _DESCRIPTION_CANDIDATES(root)]
+    parts: List[str] = []
+    # Every rule is collected before truncating: the meta/og dedupe below looks at all
+    # matched texts (as the heuristics do), not only the first MAX_DESCRIPTION_PARTS
+    for rule in DESCRIPTION_RULES:
+        for elem, classes in candidates:
+            if _matches(rule, classes):
+                text = " ".join(_strings(elem))
+                if len(text) > 20 and text not in parts:
+                    parts.append(text)
+    for xpath in (_META_DESC, _OG_DESC):
+        content = xpath(root)
+        if content and content[0] and content[0].strip() not in parts:
+            parts.insert(0, content[0].strip())
+    return parts[:MAX_DESCRIPTION_PARTS]
+
+
+def _price(root) -> str:
+    candidates = [(elem, elem.get("class")) for elem in _PRICE_CANDIDATES(root)]
+    for rule in PRICE_RULES:
+        # like select_one: only the first element matching the rule is looked at
+        elem = next((e for e, classes in candidates if _matches(rule, classes)), None)
+        if elem is not None:
+            match = PRICE_RE.search("".join(_strings(elem)).replace(',', ''))
+            if match:
+                return match.group().replace(',', '')
+    return ""
+
+
+def _image(root, raw_html: str) -> str:
+    hero = HERO_IMAGE_RE.search(raw_html)
+    if hero:
+        return html.unescape(hero.group(1))
+    for match in CDN_IMAGE_RE.finditer(raw_html):
+        url = html.unescape(match.group(1))
+        if not url.endswith('.svg') and 'gallery' not in url.lower():
+            return url
+    og_image = _OG_IMAGE(root)
+    return og_image[0] if og_image else ""
+
+
+def extract(product_url: str, raw_html: str) -> Optional[Dict[str, str]]:
+    """Product fields via the compiled spec, or None (use the heuristics) if the page has no usable <h1>."""
+    try:
+        root = lxml_html.document_fromstring(raw_html)
+    except (ValueError, etree.ParserError):
+        return None
+
+    # The heuristics also try class*=title elements when there is no <h1>; leave those pages to them
+    h1 = _H1(root)
+    if not h1:
+        return None
+    title = "".join(_strings(h1[0]))
+
+    descriptions = _descriptions(root)
+    return {
+        "product_url": product_url,
+        "product_title": title,
+        "product_description": " | ".join(descriptions) if descriptions else f"หินแกรนิต {title}",
+        "product_price": _price(root),
+        "image_url": _image(root, raw_html),
+        "image_path": "",
+    }
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+# Edge cases the spec must parse exactly like the heuristics, checked on every benchmark run.
+# Meta description equal to a [class*=detail] block that comes after three earlier parts:
+# it must be deduped against all matched texts, not only the first three.
+_PARITY_DETAIL = "Detail block text that is also used as the meta description"
+PARITY_PAGES = [
+    f"""<html><head><meta name="description" content="{_PARITY_DETAIL}"></head><body>
+    <h1>Parity Granite</h1>
+    <div class="product_description">First description block of the product page</div>
+    <div class="description">Second description block of the product page</div>
+    <div class="extra-description">Third description block of the product page</div>
+    <div class="spec-detail">{_PARITY_DETAIL}</div>
+    <span class="product_price">฿ 1,990</span>
+    </body></html>""",
+]
+
+
+def _time_per_page(parse: Callable[[str, str], Dict[str, str]], pages: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for raw in pages:
+            parse("", raw)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages) * 1000
+
+
+def fetch_pages(out_dir: Path, limit: int) -> int:
+    """Save up to limit live product pages to out_dir for benchmarking."""
+    from scrape_granite import CATEGORY_URL, ListingCrawl, create_session
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    session = create_session()
+    saved = 0
+    for url in ListingCrawl(CATEGORY_URL).crawl(session):
+        response = session.get(url, timeout=30)
+        response.encoding = 'utf-8'
+        slug = url.rstrip('/').split('/')[-1] or f"page_{saved}"
+        (out_dir / f"{slug}.html").write_text(response.text, encoding="utf-8")
+        saved += 1
+        if saved >= limit:
+            break
+    return saved
+
+
+def benchmark(page_dir: Path, repeat: int = 5) -> Dict[str, float]:
+    from scrape_granite import parse_product_html, parse_product_html_soup
+
+    pages = [p.read_text(encoding="utf-8") for p in sorted(Path(page_dir).glob("*.html"))]
+    if not pages:
+        raise SystemExit(f"No *.html pages in {page_dir}")
+
+    hits = [raw for raw in pages if extract("", raw) is not None]
+    same = sum(parse_product_html("", raw, backend="fast") == parse_product_html_soup("", raw) for raw in pages)
+    soup_ms = _time_per_page(parse_product_html_soup, pages, repeat)
+    fast_ms = _time_per_page(lambda url, raw: parse_product_html(url, raw, backend="fast"), pages, repeat)
+    parity = sum(extract("", raw) == parse_product_html_soup("", raw) for raw in PARITY_PAGES)
+    report = {
+        "pages": len(pages),
+        "spec_hits": len(hits),
+        "identical_records": same,
+        "parity_fixtures": f"{parity}/{len(PARITY_PAGES)}",
+        "bs4_ms_per_page": round(soup_ms, 3),
+        "fast_ms_per_page": round(fast_ms, 3),
+        "speedup": round(soup_ms / fast_ms, 1),
+    }
+    if hits and len(hits) < len(pages):
+        # pages the spec handles on its own (no BeautifulSoup fallback)
+        report["speedup_on_spec_hits"] = round(
+            _time_per_page(parse_product_html_soup, hits, repeat) / _time_per_page(extract, hits, repeat), 1
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product page parsers")
+    parser.add_argument("page_dir", type=Path, help="directory of saved product pages (*.html)")
+    parser.add_argument("--fetch", type=int, default=0, help="first save this many live product pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if not available():
+        raise SystemExit("lxml is not installed")
+    if args.fetch:
+        print(f"Saved {fetch_pages(args.page_dir, args.fetch)} pages to {args.page_dir}")
+    for key, value in benchmark(args.page_dir, args.repeat).items():
+        print(f"  {key}: {value}")
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import queue
+import random
+import re
+import threading
+
+from rate_limit import TokenBucket
+
+
+def is_rate_limited(e: Exception) -> bool:
+    msg = str(e)
+    return ("429" in msg) or ("Resource exhausted" in msg) or getattr(e, "code", None) == 429
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    msg = str(e)
+    return is_rate_limited(e) or any(code in msg for code in ("500", "502", "503", "504"))
+
+
+def retry_after_seconds(e: Exception) -> float | None:
+    """อ่านเวลาที่ server บอกให้รอ (Retry-After header / retry_delay ใน error) ถ้ามี"""
+    value = getattr(e, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+    m = re.search(r"retry[_ ](?:delay|in|after)\D{0,20}?(\d+(?:\.\d+)?)\s*s", str(e), re.I)
+    return float(m.group(1)) if m else None
+
+
+def prompt_fingerprint(prompt: str, scope: str = "") -> str:
+    """scope แยก prompt เดียวกันที่ยิงไปคนละ model/prefix (เช่น context cache คนละ version)"""
+    return hashlib.sha256(f"{scope}\x1f{prompt}".encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """stream ที่กำลังวิ่งอยู่ 1 ตัว: เก็บ chunk ไว้ให้ผู้รอทุกคนอ่านซ้ำได้ตั้งแต่ต้น"""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+
+    def notify(self) -> None:
+        ev, self.changed = self.changed, asyncio.Event()
+        ev.set()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
+
+
+class _Raised:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+class GeminiClient:
+    """
+    client กลางของ process สำหรับเรียก Gemini แบบ async
+    - semaphore จำกัดจำนวน request ที่ยิงพร้อมกันทั้ง process
+    - token bucket จำกัด request ต่อนาทีตาม quota
+    - retry แบบ exponential backoff + jitter (ใช้ Retry-After ถ้า server ส่งมา)
+    - timeout ต่อ request (และต่อ chunk ตอน stream)
+    - coalesce: prompt เดียวกันที่กำลังรอคำตอบอยู่ ใช้ upstream call เดียวกัน (single-flight)
+
+    model: อะไรก็ได้ที่มี `await model.generate_content_async(prompt, stream=...)`
+    (genai.GenerativeModel หรือ fake model ตอนทดสอบแบบ offline)
+    ส่ง model=... ต่อ call ได้ (เช่น model ที่ผูกกับ context cache) โดยยังใช้ limit ชุดเดียวกัน
+
+    ใช้ได้ทั้ง `await client.generate(...)` จาก event loop เดียว หรือ `client.generate_sync(...)`
+    จาก thread ธรรมดา (เช่น Streamlit) ซึ่งจะรันบน event loop ของ client เองใน background thread
+    """
+
+    def __init__(self, model, max_concurrency: int = 4, requests_per_minute: float = 60,
+                 burst: int | None = None, timeout: float = 60.0, max_retries: int = 4,
+                 base_backoff: float = 1.0, max_backoff: float = 30.0, coalesce: bool = True):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.coalesce = coalesce
+        self.coalesced = 0  # จำนวน call ที่ไปรอผลของ call อื่นแทนการยิงเอง
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max_concurrency)
+
+        self._semaphore: asyncio.Semaphore | None = None
+        self._inflight: dict[tuple, object] = {}  # ("generate"/"stream", fingerprint) -> Task / _Flight
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # async API
+    # ------------------------------------------------------------------
+    def _sem(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt: int, e: Exception) -> float:
+        server_delay = retry_after_seconds(e)
+        if server_delay is not None:
+            return server_delay + random.random()
+        return min(self.max_backoff, self.base_backoff * (2 ** attempt)) * (0.5 + random.random())
+
+    def _scope(self, model) -> str:
+        return "" if model is None else str(id(model))
+
+    async def generate(self, prompt: str, model=None) -> str:
+        if not self.coalesce:
+            return await self._generate(prompt, model)
+
+        key = ("generate", prompt_fingerprint(prompt, self._scope(model)))
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(prompt, model))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self.coalesced += 1
+        # shield: ผู้รอคนหนึ่งยกเลิก ไม่ทำให้ call ของคนอื่นถูกยกเลิกไปด้วย
+        return await asyncio.shield(task)
+
+    async def stream(self, prompt: str, model=None):
+        """async generator ของ text chunk (ผู้ที่ถาม prompt เดียวกันพร้อมกันได้ chunk ชุดเดียวกัน)"""
+        if not self.coalesce:
+            async for text in self._stream(prompt, model):
+                yield text
+            return
+
+        key = ("stream", prompt_fingerprint(prompt, self._scope(model)))
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._inflight[key] = flight
+            asyncio.ensure_future(self._run_flight(key, flight, prompt, model))
+        else:
+            self.coalesced += 1
+        async for text in flight.follow():
+            yield text
+
+    def _forget(self, key: tuple, owner: object) -> None:
+        if self._inflight.get(key) is owner:
+            del self._inflight[key]
+
+    async def _run_flight(self, key: tuple, flight: _Flight, prompt: str, model) -> None:
+        try:
+            async for text in self._stream(prompt, model):
+                flight.chunks.append(text)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(key, flight)
+            flight.notify()
+
+    async def _generate(self, prompt: str, model=None) -> str:
+        model = model or self.model
+        for attempt in range(self.max_retries):
+            await self.bucket.acquire()
+            try:
+                async with self._sem():
+                    resp = await asyncio.wait_for(model.generate_content_async(prompt), self.timeout)
+                return resp.text or ""
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries - 1:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+        raise RuntimeError("unreachable")
+
+    async def _stream(self, prompt: str, model=None):
+        """ยิง upstream แบบ stream จริง (retry ได้เฉพาะก่อนได้ chunk แรก)"""
+        model = model or self.model
+        for attempt in range(self.max_retries):
+            await self.bucket.acquire()
+            started = False
+            try:
+                async with self._sem():
+                    resp = await asyncio.wait_for(
+                        model.generate_content_async(prompt, stream=True), self.timeout
+                    )
+                    it = resp.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(it.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        try:
+                            text = chunk.text or ""
+                        except ValueError:
+                            text = ""  # chunk ที่ไม่มี text part (เช่น finish/safety)
+                        if text:
+                            started = True
+                            yield text
+                return
+            except Exception as e:
+                if started or not is_retryable(e) or attempt >= self.max_retries - 1:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    # ------------------------------------------------------------------
+    # sync bridge (สำหรับ thread ที่ไม่มี event loop เช่น Streamlit script)
+    # ------------------------------------------------------------------
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="gemini-client", daemon=True).start()
+        return self._loop
+
+    def generate_sync(self, prompt: str, model=None) -> str:
+        return asyncio.run_coroutine_threadsafe(self.generate(prompt, model), self._ensure_loop()).result()
+
+    def stream_sync(self, prompt: str, model=None):
+        """generator ธรรมดาที่ส่ง chunk ต่อจาก stream() ที่รันบน loop ของ client"""
+        q: queue.Queue = queue.Queue()
+
+        async def pump():
+            try:
+                async for text in self.stream(prompt, model):
+                    q.put(text)
+            except BaseException as e:
+                q.put(_Raised(e))
+            finally:
+                q.put(_DONE)
+
+        fut = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                item = q.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Raised):
+                    raise item.exc
+                yield item
+        finally:
+            fut.cancel()
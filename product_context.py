@@ -0,0 +1,371 @@
+import csv
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from rag_system import parse_price_intent
+
+BASE_DIR = os.path.dirname(__file__)
+CSV_PATH = os.path.join(BASE_DIR, "siamtak_granite.csv")  # ไฟล์จาก scrape_granite.py
+
+
+@dataclass(frozen=True)
+class ProductContext:
+    text: str                                   # context ที่ใส่ใน prompt ("" = ไม่มีข้อมูล)
+    version: str                                # hash ของ text (ใช้เป็น key ของ cache คำตอบ)
+    signature: tuple | None = None              # (mtime_ns, size) ของไฟล์ตอนที่อ่าน
+    products: list[dict] = field(default_factory=list)
+
+
+EMPTY_CONTEXT = ProductContext(text="", version="")
+
+_cache: dict[tuple, ProductContext] = {}  # (path, compact) -> context
+_lock = threading.Lock()
+
+
+def file_signature(path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_products(path: str = CSV_PATH) -> list[dict]:
+    """อ่าน siamtak_granite.csv -> [{"title", "price", "desc"}] (ข้ามแถวที่ไม่มีชื่อ)"""
+    products: list[dict] = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            title = (row.get("product_title") or "").strip()
+            desc = (row.get("product_description") or "").strip()
+            price = (row.get("product_price") or "").strip().replace(",", "")
+
+            if not title:
+                continue
+
+            products.append({"title": title, "price": price, "desc": desc})
+    return products
+
+
+def format_product_line(p: dict) -> str:
+    return f"- ชื่อ: {p['title']} | ราคา: {p['price']} บาท/ตร.ม. | รายละเอียด: {p['desc']}"
+
+
+# ==========================================================
+# COMPACT ENCODING (จัดกลุ่มตามประเภท/ช่วงราคา ไม่พิมพ์ชื่อซ้ำในรายละเอียด)
+# ==========================================================
+PRICE_BANDS = [0, 500, 1000, 2000, 5000]  # ขอบล่างของแต่ละช่วงราคา (บาท)
+
+
+def split_category(p: dict) -> tuple[str, str] | None:
+    """
+    รายละเอียดที่เป็นแค่ "ประเภท + ชื่อ" -> (ประเภท, ชื่อ) เช่น "หินแกรนิต GZT-0005-44" -> ("หินแกรนิต", "GZT-0005-44")
+    รายละเอียดที่มีข้อมูลมากกว่านั้นคืน None
+    """
+    title, desc = p["title"], p["desc"]
+    if not title or not desc.lower().endswith(title.lower()):
+        return None
+    rest = " ".join(desc[: len(desc) - len(title)].split())
+    return (rest or "อื่น ๆ"), title
+
+
+def price_band(price: float) -> str:
+    if price != price:  # NaN
+        return "ไม่ระบุราคา"
+    lower = max([b for b in PRICE_BANDS if b <= price] or [0])
+    i = PRICE_BANDS.index(lower)
+    if i + 1 < len(PRICE_BANDS):
+        return f"{lower:,}–{PRICE_BANDS[i + 1] - 1:,}"
+    return f"{lower:,}+"
+
+
+def _categorize(products: list[dict]) -> list[tuple[str, str, str]]:
+    """
+    (ประเภท, ชื่อ, หมายเหตุ) ต่อสินค้า
+    - รายละเอียดซ้ำกับชื่อ -> ทิ้งรายละเอียด เหลือแค่ประเภท
+    - รายละเอียดเดียวกันหลายสินค้า -> ใช้รายละเอียดเป็นประเภท (พิมพ์ครั้งเดียว)
+    - รายละเอียดยาวเฉพาะตัว -> เก็บเป็นหมายเหตุ, ประเภทตามคำนำหน้าที่รู้จัก (เช่น "หินแกรนิต")
+    """
+    split = [split_category(p) for p in products]
+    known = sorted({c[0] for c in split if c}, key=len, reverse=True)
+    desc_count: dict[str, int] = {}
+    for p, c in zip(products, split):
+        if c is None:
+            desc_count[p["desc"]] = desc_count.get(p["desc"], 0) + 1
+
+    rows: list[tuple[str, str, str]] = []
+    for p, c in zip(products, split):
+        if c is not None:
+            rows.append((c[0], c[1], ""))
+        elif p["desc"] and desc_count[p["desc"]] > 1:
+            rows.append((p["desc"], p["title"], ""))
+        else:
+            category = next((k for k in known if p["desc"].startswith(k)), "อื่น ๆ")
+            rows.append((category, p["title"], p["desc"]))
+    return rows
+
+
+def encode_products_compact(products: list[dict]) -> str:
+    """
+    ตารางแบบย่อ: 1 หัวข้อต่อประเภท, 1 บรรทัดต่อช่วงราคา, สินค้าราคาเดียวกันรวมเป็นรายการเดียว
+        [หินแกรนิต]
+        500–999: 790=GZT-0005-44, GZT-0211-44 | 899=...
+    """
+    groups: dict[str, list[tuple[float, str, str]]] = {}
+    seen: set[tuple] = set()
+    for p, (category, name, note) in zip(products, _categorize(products)):
+        if (category, name, p["price"]) in seen:  # แถวซ้ำใน CSV
+            continue
+        seen.add((category, name, p["price"]))
+        label = f"{name} ({note})" if note else name
+        groups.setdefault(category, []).append((_to_price(p["price"]), p["price"], label))
+
+    lines: list[str] = []
+    for category, items in groups.items():  # ลำดับประเภทตามที่เจอครั้งแรก
+        lines.append(f"[{category}]")
+        items.sort(key=lambda it: (it[0] != it[0], it[0]))  # ราคาน้อย -> มาก, ไม่มีราคาไว้ท้าย
+
+        bands: dict[str, dict[str, list[str]]] = {}
+        for value, raw, label in items:
+            bands.setdefault(price_band(value), {}).setdefault(raw or "-", []).append(label)
+        for band, by_price in bands.items():
+            cells = " | ".join(f"{price}={', '.join(labels)}" for price, labels in by_price.items())
+            lines.append(f"{band}: {cells}")
+    return "\n".join(lines)
+
+
+COMPACT_LEGEND = "รูปแบบ: [ประเภท] แล้วแต่ละบรรทัดคือ ช่วงราคา: ราคา=ชื่อหิน (ราคาเป็นบาท/ตร.ม.)\n"
+
+
+def build_products_context(products: list[dict], compact: bool = False) -> str:
+    """
+    รวมรายการหินเป็นข้อความยาว ๆ ให้ Gemini ใช้เป็น knowledge
+    compact=True ใช้ตารางแบบย่อ (encode_products_compact) แทน 1 บรรทัดเต็มต่อสินค้า
+    """
+    if not products:
+        return ""
+
+    if compact:
+        return (
+            "คุณเป็นผู้เชี่ยวชาญด้านหินแกรนิตและงานตกแต่งภายในของโชว์รูมหินในประเทศไทย\n"
+            "ต่อไปนี้คือรายการหินแกรนิตทั้งหมดที่มีอยู่ในระบบ (ข้อมูลจริงจากไฟล์ CSV):\n"
+            f"{COMPACT_LEGEND}"
+            f"{encode_products_compact(products)}\n\n"
+            "ให้คุณใช้ข้อมูลด้านบนในการแนะนำลูกค้าเท่านั้น ห้ามสร้างชื่อหินหรือราคาขึ้นมาเอง\n"
+        )
+
+    block = "\n".join(format_product_line(p) for p in products)
+
+    context = (
+        "คุณเป็นผู้เชี่ยวชาญด้านหินแกรนิตและงานตกแต่งภายในของโชว์รูมหินในประเทศไทย\n"
+        "ต่อไปนี้คือรายการหินแกรนิตทั้งหมดที่มีอยู่ในระบบ (ข้อมูลจริงจากไฟล์ CSV):\n"
+        f"{block}\n\n"
+        "ให้คุณใช้ข้อมูลด้านบนในการแนะนำลูกค้าเท่านั้น ห้ามสร้างชื่อหินหรือราคาขึ้นมาเอง\n"
+    )
+    return context
+
+
+def get_product_context(path: str = CSV_PATH, compact: bool = False) -> ProductContext:
+    """
+    context ของไฟล์ CSV แบบ cache ต่อ process (ใช้ร่วมกันทุก session)
+    อ่าน/สร้างใหม่เฉพาะตอนไฟล์เปลี่ยน (mtime/size ไม่ตรงกับที่ cache ไว้)
+    """
+    sig = file_signature(path)
+    if sig is None:
+        return EMPTY_CONTEXT
+
+    key = (path, compact)
+    cached = _cache.get(key)
+    if cached is not None and cached.signature == sig:
+        return cached
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached.signature == sig:
+            return cached
+
+        products = read_products(path)
+        text = build_products_context(products, compact=compact)
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16] if text else ""
+        ctx = ProductContext(text=text, version=version, signature=sig, products=products)
+        _cache[key] = ctx
+        return ctx
+
+
+def clear_cache() -> None:
+    """ทิ้ง context/index ที่ cache ไว้ทั้งหมด (อ่านไฟล์ใหม่ตอนเรียกครั้งถัดไป)"""
+    with _lock:
+        _cache.clear()
+        _index_cache.clear()
+
+
+def load_products_context(path: str = CSV_PATH) -> str:
+    """
+    โหลดข้อมูลหินจาก siamtak_granite.csv
+    รวมเป็นข้อความยาว ๆ ให้ Gemini ใช้เป็น knowledge
+    """
+    return get_product_context(path).text
+
+
+# ==========================================================
+# RETRIEVAL (ส่งเฉพาะสินค้าที่เกี่ยวข้องเข้า prompt แทนทั้ง catalog)
+# ==========================================================
+CHARS_PER_TOKEN = 3.0  # ค่าประมาณคร่าว ๆ สำหรับข้อความไทยปนอังกฤษ
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+_BUDGET_RE = re.compile(r"(?<![A-Za-z0-9-])(\d[\d,]*)(?![A-Za-z0-9-])")
+
+# คำเรื่องงบ/ราคา (ใช้ไปแล้วตอน filter งบ / เรียงราคา) ไม่ให้มีผลกับความคล้ายของข้อความ
+_PRICE_WORDS_RE = re.compile(
+    "|".join(sorted([
+        "งบประมาณ", "งบ", "ไม่เกิน", "บาท", "ราคา", "baht", "thb", "budget", "under",
+        "ถูกที่สุด", "ถูกสุด", "ต่ำสุด", "แพงที่สุด", "แพงสุด", "สูงสุด", "cheapest", "lowest", "most expensive", "highest",
+    ], key=len, reverse=True)),
+    re.IGNORECASE,
+)
+
+
+def extract_budget(text: str) -> int | None:
+    """เหมือน rag_system.extract_budget แต่ข้ามตัวเลขที่เป็นส่วนของรหัสสินค้า (เช่น GZT-0005-44)"""
+    m = _BUDGET_RE.search(text)
+    return int(m.group(1).replace(",", "")) if m else None
+
+
+def _similarity_text(text: str) -> str:
+    """คำถามที่ตัดตัวเลขงบ + คำเรื่องราคาออก (char n-gram ของ "3000" จะไปตรงกับรหัสอย่าง SH-6000-M)"""
+    return _PRICE_WORDS_RE.sub(" ", _BUDGET_RE.sub(" ", text, count=1))
+
+
+class ProductIndex:
+    """TF-IDF แบบ char n-gram (ภาษาไทยไม่มีเว้นวรรคระหว่างคำ) + ราคา ของสินค้าใน ProductContext"""
+
+    def __init__(self, products: list[dict]):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.products = products
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), lowercase=True)
+        self.matrix = self.vectorizer.fit_transform([f"{p['title']} {p['desc']}" for p in products]).tocsr()
+        self.prices = np.array([_to_price(p["price"]) for p in products], dtype=float)
+
+    def search(self, query: str, top_n: int) -> list[int]:
+        """ลำดับ index ของสินค้าที่เกี่ยวข้องกับคำถาม (งบ / ถูกสุด-แพงสุด / ความคล้ายของข้อความ)"""
+        q = query.lower()
+        budget = extract_budget(query)
+        price_intent = parse_price_intent(q)
+
+        candidates = np.arange(len(self.products))
+        if budget:
+            in_budget = candidates[self.prices <= budget]
+            if len(in_budget):
+                candidates = in_budget
+            else:
+                # ไม่มีในงบ -> ส่งตัวที่ถูกที่สุดไปให้ AI แนะนำช่วงงบที่ใกล้ที่สุด
+                price_intent = "cheapest"
+
+        if price_intent:
+            prices = self.prices[candidates]
+            prices = np.where(np.isnan(prices), np.inf if price_intent == "cheapest" else -np.inf, prices)
+            order = np.argsort(prices if price_intent == "cheapest" else -prices, kind="stable")
+            return candidates[order][:top_n].tolist()
+
+        sims = (self.matrix[candidates] @ self.vectorizer.transform([_similarity_text(query)]).T).toarray().ravel()
+        order = np.argsort(-sims, kind="stable")
+        return candidates[order][:top_n].tolist()
+
+
+_index_cache: dict[str, ProductIndex] = {}
+
+
+def _to_price(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def get_product_index(ctx: ProductContext) -> ProductIndex:
+    """index ต่อ version ของ context (สร้างครั้งเดียวจนกว่าไฟล์จะเปลี่ยน)"""
+    idx = _index_cache.get(ctx.version)
+    if idx is None:
+        with _lock:
+            idx = _index_cache.get(ctx.version)
+            if idx is None:
+                idx = ProductIndex(ctx.products)
+                _index_cache.clear()  # เก็บแค่ version ล่าสุด
+                _index_cache[ctx.version] = idx
+    return idx
+
+
+def _line_cost(p: dict, compact: bool) -> int:
+    if compact:
+        c = split_category(p)
+        # ชื่อ + ราคา (หรือ + รายละเอียดถ้าไม่ซ้ำกับชื่อ); หัวข้อกลุ่มไม่นับ
+        return estimate_tokens(f"{p['price']}={p['title'] if c else p['title'] + ' ' + p['desc']}, ")
+    return estimate_tokens(format_product_line(p) + "\n")
+
+
+def build_retrieval_context(ctx: ProductContext, query: str, top_n: int = 15,
+                            token_budget: int = 1500, compact: bool = False,
+                            pinned: list[str] | None = None) -> ProductContext:
+    """
+    context เฉพาะสินค้าที่เกี่ยวข้องกับคำถาม (ไม่เกิน top_n รายการ และไม่เกิน token_budget โดยประมาณ)
+    pinned: ชื่อสินค้าที่ต้องมีเสมอ (เช่น หินที่เพิ่งแนะนำไปในบทสนทนา) ใส่ไว้ก่อนผลค้นหา
+    """
+    if not ctx.products:
+        return EMPTY_CONTEXT
+
+    idx = get_product_index(ctx)
+    order: list[int] = []
+    if pinned:
+        by_title = {p["title"]: i for i, p in enumerate(ctx.products)}
+        order = [by_title[t] for t in pinned if t in by_title]
+    order += [i for i in idx.search(query, top_n) if i not in order]
+
+    picked: list[dict] = []
+    used = 0
+    for i in order[:top_n]:
+        p = ctx.products[i]
+        cost = _line_cost(p, compact)
+        if picked and used + cost > token_budget:
+            break
+        picked.append(p)
+        used += cost
+
+    if compact:
+        block = COMPACT_LEGEND + encode_products_compact(picked)
+    else:
+        block = "\n".join(format_product_line(p) for p in picked)
+    text = (
+        "คุณเป็นผู้เชี่ยวชาญด้านหินแกรนิตและงานตกแต่งภายในของโชว์รูมหินในประเทศไทย\n"
+        f"ต่อไปนี้คือรายการหินแกรนิตที่เกี่ยวข้องกับคำถาม {len(picked)} รายการ "
+        f"(คัดมาจากทั้งหมด {len(ctx.products)} รายการในไฟล์ CSV):\n"
+        f"{block}\n\n"
+        "ให้คุณใช้ข้อมูลด้านบนในการแนะนำลูกค้าเท่านั้น ห้ามสร้างชื่อหินหรือราคาขึ้นมาเอง\n"
+    )
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return ProductContext(text=text, version=version, signature=ctx.signature, products=picked)
+
+
+def compaction_report(path: str = CSV_PATH) -> dict:
+    """จำนวน token โดยประมาณของ context แบบเดิมเทียบกับแบบย่อ"""
+    before = estimate_tokens(get_product_context(path).text)
+    after = estimate_tokens(get_product_context(path, compact=True).text)
+    return {
+        "products": len(get_product_context(path).products),
+        "tokens_before": before,
+        "tokens_after": after,
+        "saved_pct": round(100 * (1 - after / before), 1) if before else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    print(compaction_report())
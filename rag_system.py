@@ -1,30 +1,29 @@
+import hashlib
+import itertools
+import json
+import logging
 import os
 import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 
-# ======================
-# LOAD DATA
-# ======================
-BASE_DIR = os.path.dirname(__file__)
-
-granite = pd.read_csv(os.path.join(BASE_DIR, "granite_dataset.csv"), encoding="latin1")
-marble  = pd.read_csv(os.path.join(BASE_DIR, "marble_dataset.csv"),  encoding="latin1")
+from stone_dictionary import STONE_TRANSLATIONS
 
-# normalize column names
-granite.columns = granite.columns.str.strip().str.lower()
-marble.columns  = marble.columns.str.strip().str.lower()
+logger = logging.getLogger(__name__)
 
-# concat
-df = pd.concat([granite, marble], ignore_index=True)
-df.columns = df.columns.str.strip().str.lower()
-df = df.loc[:, ~df.columns.duplicated()]
+BASE_DIR = os.path.dirname(__file__)
+CSV_FILES = ["granite_dataset.csv", "marble_dataset.csv"]
 
-# convert price
-df["price_min"] = pd.to_numeric(df.get("price_min"), errors="coerce")
-df["price_max"] = pd.to_numeric(df.get("price_max"), errors="coerce")
-df = df.dropna(subset=["price_min"])
+# snapshot ของ catalog ที่ build แล้ว (เปลี่ยน SNAPSHOT_VERSION เมื่อ format/การ normalize เปลี่ยน)
+SNAPSHOT_DIR = os.getenv("STONE_SNAPSHOT_DIR", os.path.join(BASE_DIR, ".catalog_cache"))
+SNAPSHOT_VERSION = 2
 
 # ======================
 # NORMALIZE STYLE TAG -> style_tag_norm (เหลือ 4 แนวหลัก)
@@ -66,19 +65,411 @@ def normalize_style_tag(val: str) -> str:
     ordered = [x for x in CANON_STYLES if x in mapped]
     return "|".join(ordered)
 
-if "style_tag" in df.columns:
-    df["style_tag_norm"] = df["style_tag"].apply(normalize_style_tag)
-else:
-    df["style_tag_norm"] = ""
+# ======================
+# LOAD DATA (CSV)
+# ======================
+def _load_csv_catalog(base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES) -> pd.DataFrame:
+    frames = []
+    for name in csv_files:
+        part = pd.read_csv(os.path.join(base_dir, name), encoding="latin1")
+        # normalize column names
+        part.columns = part.columns.str.strip().str.lower()
+        frames.append(part)
+
+    # concat
+    df = pd.concat(frames, ignore_index=True)
+    df.columns = df.columns.str.strip().str.lower()
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    # convert price
+    df["price_min"] = pd.to_numeric(df.get("price_min"), errors="coerce")
+    df["price_max"] = pd.to_numeric(df.get("price_max"), errors="coerce")
+    # reset index -> index label == row position ใน doc_matrix
+    df = df.dropna(subset=["price_min"]).reset_index(drop=True)
+
+    if "style_tag" in df.columns:
+        df["style_tag_norm"] = df["style_tag"].apply(normalize_style_tag)
+    else:
+        df["style_tag_norm"] = ""
+
+    # combine text (ใช้ข้อมูลดิบ + norm ช่วยให้ similarity จับ intent ได้ดีขึ้น)
+    df["combined_text"] = df.astype(str).agg(" ".join, axis=1)
+    return df
+
+def _fit_vectorizer(df: pd.DataFrame):
+    vectorizer = TfidfVectorizer()
+
+    # document matrix คำนวณครั้งเดียวตอนโหลด (แถวที่ i = df.iloc[i])
+    # TfidfVectorizer ทำ l2-normalize ให้แล้ว -> cosine = dot product
+    doc_matrix = vectorizer.fit_transform(df["combined_text"]).tocsr()
+    return vectorizer, doc_matrix
+
+# ======================
+# SNAPSHOT (columnar .npy + vocabulary/idf + sparse matrix, โหลดแบบ mmap)
+# ======================
+def catalog_hash(base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES) -> str:
+    """hash ของไฟล์ CSV ต้นทาง + SNAPSHOT_VERSION (เปลี่ยน = ต้อง rebuild)"""
+    h = hashlib.sha256(f"v{SNAPSHOT_VERSION}".encode())
+    for name in csv_files:
+        h.update(name.encode())
+        with open(os.path.join(base_dir, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+def _snapshot_prefix(base_dir: str, csv_files: list[str]) -> str:
+    """prefix ต่อชุดไฟล์ต้นทาง (หลาย catalog ใช้ SNAPSHOT_DIR ร่วมกันได้โดยไม่ลบของกันและกัน)"""
+    paths = "|".join(os.path.abspath(os.path.join(base_dir, n)) for n in csv_files)
+    return hashlib.sha256(paths.encode()).hexdigest()[:8] + "-"
+
+_VALUE_TYPES = [str, int, float, bool]
+
+def _value_type(v) -> int:
+    if isinstance(v, (bool, np.bool_)):
+        return 3
+    if isinstance(v, (int, np.integer)):
+        return 1
+    if isinstance(v, (float, np.floating)):
+        return 2
+    return 0
+
+def _codes_dtype(n_categories: int):
+    """dtype เดียวกับที่ pandas ใช้เก็บ codes ของ Categorical -> from_codes ไม่ copy (ยัง mmap อยู่)"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def _categorical(codes: np.ndarray, values: np.ndarray, types: np.ndarray) -> pd.Categorical:
+    cats = pd.Index(
+        [v == "True" if t == 3 else _VALUE_TYPES[t](v) for v, t in zip(values.tolist(), types.tolist())],
+        dtype=object,
+    )
+    return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(cats), validate=False)
+
+def _save_snapshot(path: str, key: str, df: pd.DataFrame, vectorizer, doc_matrix) -> None:
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            np.save(os.path.join(path, f"col_{i}.npy"), values.to_numpy())
+            columns.append({"name": col, "kind": "num"})
+        else:
+            # object column -> dictionary encode: codes (mmap ได้) + ค่าไม่ซ้ำพร้อมชนิดเดิม
+            # (price_cut_min ปน int/str -> โหลดกลับมาต้องได้ 2990 ไม่ใช่ '2990')
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            codes = codes.astype(_codes_dtype(len(uniques)))
+            np.save(os.path.join(path, f"col_{i}.npy"), codes)
+            np.save(os.path.join(path, f"col_{i}_cats.npy"), np.array([str(v) for v in uniques], dtype=str))
+            np.save(os.path.join(path, f"col_{i}_types.npy"), np.array([_value_type(v) for v in uniques], dtype=np.uint8))
+            columns.append({"name": col, "kind": "cat"})
+
+    np.save(os.path.join(path, "vocab.npy"), vectorizer.get_feature_names_out().astype(str))
+    np.save(os.path.join(path, "idf.npy"), vectorizer.idf_)
+    np.save(os.path.join(path, "doc_data.npy"), doc_matrix.data)
+    np.save(os.path.join(path, "doc_indices.npy"), doc_matrix.indices)
+    np.save(os.path.join(path, "doc_indptr.npy"), doc_matrix.indptr)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "key": key,
+        "rows": len(df),
+        "columns": columns,
+        "doc_shape": list(doc_matrix.shape),
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+def _load_snapshot(path: str):
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    data = {}
+    for i, c in enumerate(meta["columns"]):
+        values = load(f"col_{i}.npy")
+        if c["kind"] == "cat":
+            # codes ยังเป็น mmap; materialize เฉพาะค่าไม่ซ้ำ (แถวที่ตอบกลับแปลงเป็น object ใน Catalog.take)
+            values = _categorical(values, load(f"col_{i}_cats.npy"), load(f"col_{i}_types.npy"))
+        data[c["name"]] = values
+    df = pd.DataFrame(data, columns=[c["name"] for c in meta["columns"]], copy=False)
+
+    terms = load("vocab.npy").tolist()
+    vectorizer = TfidfVectorizer(vocabulary={t: i for i, t in enumerate(terms)})
+    vectorizer.idf_ = np.asarray(load("idf.npy"))
+
+    doc_matrix = sp.csr_matrix(
+        (load("doc_data.npy"), load("doc_indices.npy"), load("doc_indptr.npy")),
+        shape=tuple(meta["doc_shape"]),
+        copy=False,
+    )
+    return df, vectorizer, doc_matrix
+
+def snapshot_path(base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES, key: str | None = None) -> str:
+    key = key or catalog_hash(base_dir, csv_files)
+    return os.path.join(SNAPSHOT_DIR, _snapshot_prefix(base_dir, csv_files) + key)
+
+def build_snapshot(base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES, key: str | None = None):
+    """โหลด CSV + fit แล้วเขียน snapshot ลง SNAPSHOT_DIR (rename แบบ atomic)"""
+    key = key or catalog_hash(base_dir, csv_files)
+    df = _load_csv_catalog(base_dir, csv_files)
+    vectorizer, doc_matrix = _fit_vectorizer(df)
+
+    prefix = _snapshot_prefix(base_dir, csv_files)
+    target = os.path.join(SNAPSHOT_DIR, prefix + key)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f".{key}-", dir=SNAPSHOT_DIR)
+        os.chmod(tmp, 0o755)
+        _save_snapshot(tmp, key, df, vectorizer, doc_matrix)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            # worker อื่น build เสร็จก่อนแล้ว
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        # ลบ snapshot เก่าของ catalog เดียวกันที่ key ไม่ตรงแล้ว
+        for name in os.listdir(SNAPSHOT_DIR):
+            if name.startswith(prefix) and name != prefix + key:
+                shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+    except OSError as e:
+        logger.warning(f"Cannot write catalog snapshot to {target}: {e}")
+
+    return df, vectorizer, doc_matrix
+
+def load_catalog(base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES,
+                 use_snapshot: bool = True, key: str | None = None):
+    """คืน (df, vectorizer, doc_matrix) จาก snapshot ถ้า key ตรง ไม่งั้น build ใหม่"""
+    if not use_snapshot:
+        df = _load_csv_catalog(base_dir, csv_files)
+        return (df, *_fit_vectorizer(df))
+
+    key = key or catalog_hash(base_dir, csv_files)
+    path = snapshot_path(base_dir, csv_files, key)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        try:
+            return _load_snapshot(path)
+        except Exception as e:
+            logger.warning(f"Catalog snapshot {path} is unreadable, rebuilding: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    return build_snapshot(base_dir, csv_files, key)
+
+# ======================
+# INVERTED INDEX (สร้างครั้งเดียวตอนโหลด: token -> posting ของ row ids ที่เรียงแล้ว)
+# ======================
+ROW_DTYPE = np.int32
+_EMPTY_ROWS = np.empty(0, dtype=ROW_DTYPE)
+
+STYLE_MAP = {
+    "หรู": "luxury", "luxury": "luxury",
+    "มินิมอล": "minimal", "minimal": "minimal",
+    "โมเดิร์น": "modern", "modern": "modern",
+    "คลาสสิก": "classic", "classic": "classic",
+}
+
+# pattern ของ popular_use ต่อ intent (ใช้ทั้ง filter และ usage_score)
+USE_PATTERNS = {
+    "kitchen": "counter|kitchen|island",
+    "floor": "floor",
+    "wall": "wall|cladding",
+}
+OUTDOOR_VALUES = ["outdoor", "both"]
+
+# diversity: คอลัมน์ -> ห้ามซ้ำจนกว่าจะเลือกได้กี่ตัว (None = ห้ามซ้ำตลอด)
+# ค่า default = พฤติกรรมเดิม: ชื่อห้ามซ้ำ, origin ให้ซ้ำได้หลังเลือกไปแล้ว 2 ตัว
+DEFAULT_DIVERSITY = {"stone_name": None, "origin_country": 2}
+DIVERSITY_COLUMNS = ["stone_name", "origin_country", "color_main", "pattern_type"]
+MMR_POOL = 50
+
+def _split_pipe(val) -> list[str]:
+    return [t for t in str(val).split("|") if t]
+
+def _split_comma(val) -> list[str]:
+    return [t.strip() for t in str(val).lower().split(",") if t.strip()]
+
+def _build_postings(df: pd.DataFrame, col: str, tokenize, seed=()) -> dict[str, np.ndarray] | None:
+    """token -> sorted row ids (None ถ้าไม่มีคอลัมน์ -> ข้าม filter)"""
+    if col not in df.columns:
+        return None
+
+    buckets: dict[str, list[int]] = {t: [] for t in seed}
+    for row_id, val in enumerate(df[col].to_numpy()):
+        for t in tokenize(val):
+            buckets.setdefault(t, []).append(row_id)
+
+    return {t: np.unique(np.asarray(ids, dtype=ROW_DTYPE)) for t, ids in buckets.items()}
+
+def _union(postings: dict[str, np.ndarray], tokens) -> np.ndarray:
+    parts = [postings[t] for t in tokens if t in postings]
+    return np.unique(np.concatenate(parts)) if parts else _EMPTY_ROWS
+
+def _member(rows: np.ndarray, posting: np.ndarray) -> np.ndarray:
+    """bool ต่อ row ใน rows ว่าอยู่ใน posting ไหม (binary search, O(len(rows) log len(posting)))"""
+    if len(posting) == 0 or len(rows) == 0:
+        return np.zeros(len(rows), dtype=bool)
+    pos = np.minimum(np.searchsorted(posting, rows), len(posting) - 1)
+    return posting[pos] == rows
+
+def _intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) > len(b):
+        a, b = b, a
+    return a[_member(a, b)]
 
-# combine text (ใช้ข้อมูลดิบ + norm ช่วยให้ similarity จับ intent ได้ดีขึ้น)
-df["combined_text"] = df.astype(str).agg(" ".join, axis=1)
+# ======================
+# PRICE INDEX (ราคาเรียงไว้ครั้งเดียว -> งบ/ถูกสุด/แพงสุด ไม่ต้อง sort ทุก query)
+# ======================
+class PriceIndex:
+    """row ids เรียงตามราคา (ข้ามแถวที่ไม่มีราคา) สำหรับ range query แบบ binary search"""
+
+    def __init__(self, prices: np.ndarray):
+        self.n_rows = len(prices)
+        valid = np.flatnonzero(~np.isnan(prices))
+        order = valid[np.argsort(prices[valid], kind="stable")]
+        self.rows = order.astype(ROW_DTYPE)
+        self.values = prices[order]
+        # แพงสุดก่อน แต่ราคาเท่ากันยังเรียงตาม row id (stable แบบ sort_values(ascending=False) เดิม)
+        self.rows_desc = valid[np.argsort(-prices[valid], kind="stable")].astype(ROW_DTYPE)
+        # ตำแหน่งใน self.rows ของแต่ละ row id (แถวไม่มีราคา = len -> อยู่นอกทุกช่วง)
+        self.position = np.full(self.n_rows, len(order), dtype=ROW_DTYPE)
+        self.position[order] = np.arange(len(order), dtype=ROW_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _bounds(self, lo: float | None, hi: float | None) -> tuple[int, int]:
+        start = 0 if lo is None else int(np.searchsorted(self.values, lo, side="left"))
+        end = len(self.values) if hi is None else int(np.searchsorted(self.values, hi, side="right"))
+        return start, end
+
+    def range(self, lo: float | None = None, hi: float | None = None) -> np.ndarray:
+        """row ids ที่ lo <= price <= hi เรียงตามราคา (O(log n) + view ไม่ copy)"""
+        start, end = self._bounds(lo, hi)
+        return self.rows[start:end]
+
+    def within(self, rows: np.ndarray, lo: float | None = None, hi: float | None = None) -> np.ndarray:
+        """rows ที่ lo <= price <= hi คงลำดับเดิมของ rows (เทียบตำแหน่งใน index ต่อแถว O(len(rows)) ไม่ sort)"""
+        start, end = self._bounds(lo, hi)
+        pos = self.position[rows]
+        return rows[(pos >= start) & (pos < end)]
+
+    def iter_ranked(self, candidates: np.ndarray | None = None, descending: bool = False, chunk: int = 64):
+        """row ids ใน candidates เรียงตามราคา (generator): อ่าน index เพิ่มเท่าที่ผู้เรียกดึงจริง (top-k อ่านแค่ต้น ๆ)"""
+        order = self.rows_desc if descending else self.rows
+        full = candidates is None or len(candidates) == len(self.rows) == self.n_rows
+        for start in range(0, len(order), chunk):
+            block = order[start:start + chunk]
+            if not full:
+                block = block[_member(block, candidates)]
+            yield from block.tolist()
 
 # ======================
-# VECTORIZE
+# CATALOG (df + vectorizer + index ทั้งหมด; immutable หลังสร้าง -> สลับทั้งก้อนตอน reload)
 # ======================
-vectorizer = TfidfVectorizer()
-vectorizer.fit(df["combined_text"])
+class Catalog:
+    def __init__(self, df: pd.DataFrame, vectorizer, doc_matrix, version: str):
+        self.df = df
+        self.vectorizer = vectorizer
+        self.doc_matrix = doc_matrix
+        self.version = version
+
+        self.n_rows = len(df)
+        self.all_rows = np.arange(self.n_rows, dtype=ROW_DTYPE)
+        # คอลัมน์ dictionary-encoded จาก snapshot -> แปลงกลับเป็น object ตอนตอบ (ให้เหมือนโหลดจาก CSV)
+        self._object_columns = {c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}
+
+        self.index = {
+            "stone_type": _build_postings(
+                df, "stone_type", lambda v: [str(v).strip().lower()], seed=STONE_TRANSLATIONS["stone_type"]
+            ),
+            "style": _build_postings(df, "style_tag_norm", _split_pipe, seed=CANON_STYLES),
+            "indoor_outdoor": _build_postings(
+                df, "indoor_outdoor", lambda v: [str(v).lower()], seed=STONE_TRANSLATIONS["indoor_outdoor"]
+            ),
+            "popular_use": _build_postings(
+                df, "popular_use", _split_comma, seed=STONE_TRANSLATIONS["popular_use"]
+            ),
+        }
+
+        # posting รวมต่อ intent: usage token ทุกตัวที่ match pattern (floor -> floor, flooring, statement_floor, ...)
+        self.use_postings = None
+        if self.index["popular_use"] is not None:
+            self.use_postings = {
+                k: _union(self.index["popular_use"], [t for t in self.index["popular_use"] if re.search(p, t)])
+                for k, p in USE_PATTERNS.items()
+            }
+
+        self.outdoor_posting = None
+        if self.index["indoor_outdoor"] is not None:
+            self.outdoor_posting = _union(self.index["indoor_outdoor"], OUTDOOR_VALUES)
+
+        self.price_min = df["price_min"].to_numpy(dtype=float)
+        # งบ / ถูกสุด / แพงสุด ใช้ price_min อย่างเดียว
+        self.price_index = PriceIndex(self.price_min)
+
+        # term -> doc (CSR ของ doc_matrix.T): query @ term_doc แตะเฉพาะ doc ที่มีคำของ query
+        self.term_doc = doc_matrix.T.tocsr()
+
+        # flag ต่อแถว (rows x intent) สำหรับ usage/outdoor score แบบ vectorized
+        self.use_flags = np.zeros((self.n_rows, len(USE_PATTERNS)))
+        if self.use_postings is not None:
+            for j, key in enumerate(USE_PATTERNS):
+                self.use_flags[self.use_postings[key], j] = 1.0
+        self.outdoor_flags = np.zeros(self.n_rows)
+        if self.outdoor_posting is not None:
+            self.outdoor_flags[self.outdoor_posting] = 1.0
+
+        # analyzer เดียวกับ vectorizer -> ใช้ทำ cache key จาก token ที่อยู่ใน vocabulary
+        self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary = vectorizer.vocabulary_
+
+        # integer code ต่อคอลัมน์สำหรับ diversity (สร้างล่วงหน้าสำหรับคอลัมน์ที่ใช้บ่อย)
+        self._codes: dict[str, np.ndarray | None] = {}
+        for col in DIVERSITY_COLUMNS:
+            self.codes(col)
+
+    def take(self, ids) -> pd.DataFrame:
+        """แถวตาม row ids ด้วยชนิดข้อมูลเดียวกับ catalog ที่โหลดจาก CSV"""
+        picked = self.df.iloc[ids]
+        return picked.astype(self._object_columns) if self._object_columns else picked
+
+    def codes(self, col: str) -> np.ndarray | None:
+        """ค่า lower/strip ของคอลัมน์ -> int code (ค่าว่าง = -1, None ถ้าไม่มีคอลัมน์)"""
+        if col not in self._codes:
+            src = col
+            if col == "origin_country" and col not in self.df.columns:
+                src = "origin"
+            if src not in self.df.columns:
+                self._codes[col] = None
+            else:
+                values = self.df[src].astype(str).str.lower().str.strip()
+                codes, _ = pd.factorize(values.where(values != "", None))
+                self._codes[col] = codes.astype(np.int32)
+        return self._codes[col]
+
+    @classmethod
+    def load(cls, base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES,
+             use_snapshot: bool = True) -> "Catalog":
+        key = catalog_hash(base_dir, csv_files)
+        df, vectorizer, doc_matrix = load_catalog(base_dir, csv_files, use_snapshot=use_snapshot, key=key)
+        return cls(df, vectorizer, doc_matrix, version=key)
+
+    def base_rows(self, query_lower: str, stone_type: str | None) -> np.ndarray:
+        """row ids ที่ผ่าน stone type + style (ใช้ซ้ำตอน fallback ได้เลย)"""
+        rows = self.all_rows
+
+        # 0) Stone Type Filter
+        if stone_type in ["granite", "marble"] and self.index["stone_type"] is not None:
+            rows = self.index["stone_type"].get(stone_type, _EMPTY_ROWS)
+
+        # 1) Style Filter (AND logic: ต้อง match ทุกสไตล์ที่พิมพ์มา)
+        if self.index["style"] is not None:
+            for s in _parse_styles(query_lower):
+                rows = _intersect(rows, self.index["style"][s])
+
+        return rows
 
 # ======================
 # HELPERS
@@ -90,32 +481,56 @@ def extract_budget(text: str):
 def _has_any(query_lower: str, keywords: list[str]) -> bool:
     return any(k in query_lower for k in keywords)
 
-def _apply_style_filter(filtered_df: pd.DataFrame, query_lower: str) -> pd.DataFrame:
-    col = "style_tag_norm" if "style_tag_norm" in filtered_df.columns else "style_tag"
-    if col not in filtered_df.columns:
-        return filtered_df
-
-    STYLE_MAP = {
-        "หรู": "luxury", "luxury": "luxury",
-        "มินิมอล": "minimal", "minimal": "minimal",
-        "โมเดิร์น": "modern", "modern": "modern",
-        "คลาสสิก": "classic", "classic": "classic",
-    }
-
+def _parse_styles(query_lower: str) -> list[str]:
     styles = []
     for k, v in STYLE_MAP.items():
         if k in query_lower and v not in styles:
             styles.append(v)
-
-    if not styles:
-        return filtered_df
-
-    # AND logic: ต้อง match ทุกสไตล์ที่พิมพ์มา
-    for s in styles:
-        filtered_df = filtered_df[
-            filtered_df[col].astype(str).str.contains(rf"(?:^|\|){s}(?:\||$)", na=False)
-        ]
-    return filtered_df
+    return styles
+
+def parse_price_intent(query_lower: str) -> str | None:
+    if _has_any(query_lower, ["ถูกสุด", "ถูกที่สุด", "ราคาต่ำสุด", "ต่ำสุด", "cheapest", "lowest"]):
+        return "cheapest"
+    if _has_any(query_lower, ["แพงสุด", "แพงที่สุด", "ราคาสูงสุด", "สูงสุด", "most expensive", "highest"]):
+        return "expensive"
+    return None
+
+def _gather_similarity(sims, i: int, rows: np.ndarray) -> np.ndarray:
+    """similarity ของ query แถว i (sparse, query x doc) เฉพาะ rows ที่เรียงตาม id แล้ว"""
+    start, end = sims.indptr[i], sims.indptr[i + 1]
+    doc_ids, values = sims.indices[start:end], sims.data[start:end]
+
+    out = np.zeros(len(rows))
+    if len(rows) == 0 or len(doc_ids) == 0:
+        return out
+    pos = np.minimum(np.searchsorted(rows, doc_ids), len(rows) - 1)
+    hit = rows[pos] == doc_ids
+    out[pos[hit]] = values[hit]
+    return out
+
+def query_signature(cat: Catalog, user_query: str, top_k: int, stone_type: str | None,
+                    diversity: dict | None, mmr_lambda: float | None) -> tuple:
+    """key ของ query หลัง normalize: query ที่ key เท่ากันได้ผลลัพธ์เหมือนกันทุกอย่าง
+
+    ใช้ทุกอย่างที่ retrieve ใช้จริง (งบ, สไตล์, intent, filter, stone_type, top_k)
+    + token ที่อยู่ใน vocabulary (token นอก vocab ไม่มีผลกับ TF-IDF อยู่แล้ว)
+    """
+    q = user_query.lower()
+    intent = parse_intent(user_query)
+    tokens = tuple(sorted(t for t in cat.analyzer(user_query) if t in cat.vocabulary))
+    return (
+        cat.version,
+        extract_budget(user_query),
+        tuple(_parse_styles(q)),
+        tuple(k for k, v in intent.items() if v),
+        _has_any(q, ["ปูพื้น", "floor"]),
+        parse_price_intent(q),
+        stone_type if stone_type in ["granite", "marble"] else None,
+        top_k,
+        tokens,
+        tuple((diversity or DEFAULT_DIVERSITY).items()),
+        mmr_lambda,
+    )
 
 def parse_intent(q: str) -> dict:
     q = q.lower()
@@ -126,179 +541,394 @@ def parse_intent(q: str) -> dict:
         "want_outdoor": _has_any(q, ["ภายนอก", "outdoor"]),
     }
 
-def _select_diverse(result_df: pd.DataFrame, top_k: int) -> pd.DataFrame:
-    """เลือก top_k แบบไม่ซ้ำกันเกินไป (ชื่อ/ประเทศ)"""
-    if len(result_df) <= top_k:
-        return result_df.head(top_k)
-
-    picked_idx = []
-    used_names = set()
-    used_origins = set()
-
-    for idx, r in result_df.iterrows():
-        name = str(r.get("stone_name", "")).lower().strip()
-        origin = str(r.get("origin_country", r.get("origin", ""))).lower().strip()
-
-        if name and name in used_names:
-            continue
+def _select_diverse(cat: Catalog, ranked, top_k: int, diversity: dict | None = None,
+                    total: int | None = None) -> tuple[list[int], list[int]]:
+    """เลือก top_k แบบไม่ซ้ำกันเกินไป (default: ชื่อ/ประเทศ) ในรอบเดียวตามลำดับ ranked
+
+    ranked เป็น array หรือ iterable ของ row ids (อ่านเท่าที่จำเป็น) คืน (row ids, อันดับใน ranked)
+    """
+    if total is None:
+        total = len(ranked)
+    if total <= top_k:
+        ids = list(itertools.islice(ranked, top_k))
+        return ids, list(range(len(ids)))
+
+    keys = []
+    for col, until in (diversity or DEFAULT_DIVERSITY).items():
+        codes = cat.codes(col)
+        if codes is not None:
+            keys.append((codes, until, set()))
+
+    picked_ids, picked_ranks = [], []
+    skipped_ids, skipped_ranks = [], []
+
+    for rank, row_id in enumerate(ranked):
+        ok = True
+        for codes, until, used in keys:
+            c = codes[row_id]
+            if c >= 0 and c in used and (until is None or len(picked_ids) < until):
+                ok = False
+                break
 
-        # กัน origin ซ้ำหนัก ๆ (ให้ซ้ำได้หลังเลือกไปแล้ว 2 ตัว)
-        if origin and origin in used_origins and len(picked_idx) < 2:
+        if not ok:
+            skipped_ids.append(row_id)
+            skipped_ranks.append(rank)
             continue
 
-        picked_idx.append(idx)
-        if name:
-            used_names.add(name)
-        if origin:
-            used_origins.add(origin)
+        picked_ids.append(row_id)
+        picked_ranks.append(rank)
+        for codes, _, used in keys:
+            if codes[row_id] >= 0:
+                used.add(codes[row_id])
 
-        if len(picked_idx) >= top_k:
+        if len(picked_ids) >= top_k:
             break
 
-    # ถ้าเลือกไม่ครบ ให้เติมเพิ่มจากอันดับถัดไป
-    if len(picked_idx) < top_k:
-        for idx in result_df.index:
-            if idx not in picked_idx:
-                picked_idx.append(idx)
-            if len(picked_idx) >= top_k:
-                break
+    # ถ้าเลือกไม่ครบ ให้เติมเพิ่มจากอันดับถัดไป (ตัวที่ข้ามไว้ เรียงตามอันดับเดิม)
+    need = top_k - len(picked_ids)
+    if need > 0:
+        picked_ids += skipped_ids[:need]
+        picked_ranks += skipped_ranks[:need]
+
+    # ตัดท้ายเหมือน .head(top_k) ของเดิม (top_k=0 -> ว่าง)
+    return picked_ids[:top_k], picked_ranks[:top_k]
+
+def _select_mmr(cat: Catalog, ranked_ids: np.ndarray, relevance: np.ndarray, top_k: int,
+                mmr_lambda: float) -> list[int]:
+    """MMR: relevance * lambda - (1 - lambda) * similarity สูงสุดกับตัวที่เลือกแล้ว (TF-IDF cosine)"""
+    vecs = cat.doc_matrix[ranked_ids]
+    gram = (vecs @ vecs.T).toarray()
+
+    max_sim = np.zeros(len(ranked_ids))
+    available = np.ones(len(ranked_ids), dtype=bool)
+    picked = []
+    for _ in range(min(top_k, len(ranked_ids))):
+        score = mmr_lambda * relevance - (1 - mmr_lambda) * max_sim
+        score[~available] = -np.inf
+        j = int(np.argmax(score))
+        picked.append(j)
+        available[j] = False
+        max_sim = np.maximum(max_sim, gram[j])
+    return picked
 
-    return result_df.loc[picked_idx].head(top_k)
+# ======================
+# QUERY CACHE (LRU + TTL)
+# ======================
+class QueryCache:
+    """LRU + TTL สำหรับผล retrieve (thread-safe) เก็บ/คืนเป็น copy กันผู้เรียกไปแก้ของใน cache"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, value = item
+            if expires < now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return value.copy()
+
+    def put(self, key, value) -> None:
+        value = value.copy()
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
 # ======================
-# RETRIEVE (FULL VERSION)
+# RETRIEVER (โหลด lazy ตอนใช้ครั้งแรก + reload แบบ hot-swap)
 # ======================
-def retrieve_stones(user_query: str, top_k: int = 3, stone_type: str | None = None) -> pd.DataFrame:
-    filtered_df = df.copy()
-    query_lower = user_query.lower()
-
-    # 0) Stone Type Filter
-    if stone_type in ["granite", "marble"] and "stone_type" in filtered_df.columns:
-        filtered_df = filtered_df[
-            filtered_df["stone_type"].astype(str).str.strip().str.lower() == stone_type
-        ]
-
-    # 1) Style Filter (จากคำถาม)
-    filtered_df = _apply_style_filter(filtered_df, query_lower)
-
-    # 2) Budget Filter (ถ้างบแล้วว่าง -> คืนว่างทันที)
-    budget = extract_budget(user_query)
-    budget_applied = False
-    if budget:
-        budget_applied = True
-        filtered_df = filtered_df[filtered_df["price_min"] <= budget]
-
-    # 3) Outdoor Filter
-    want_outdoor = _has_any(query_lower, ["ภายนอก", "outdoor"])
-    if want_outdoor and "indoor_outdoor" in filtered_df.columns:
-        filtered_df = filtered_df[
-            filtered_df["indoor_outdoor"].astype(str).str.lower().isin(["outdoor", "both"])
-        ]
-
-    # 4) Floor Filter
-    want_floor = _has_any(query_lower, ["ปูพื้น", "floor"])
-    if want_floor and "popular_use" in filtered_df.columns:
-        filtered_df = filtered_df[
-            filtered_df["popular_use"].astype(str).str.lower().str.contains("floor", na=False)
-        ]
-
-    # fallback เฉพาะกรณีไม่มีงบ
-    if len(filtered_df) == 0:
-        if budget_applied:
-            return filtered_df.head(0)
-
-        filtered_df = df.copy()
-        if stone_type in ["granite", "marble"] and "stone_type" in filtered_df.columns:
-            filtered_df = filtered_df[
-                filtered_df["stone_type"].astype(str).str.strip().str.lower() == stone_type
-            ]
-        filtered_df = _apply_style_filter(filtered_df, query_lower)
-
-        if len(filtered_df) == 0:
-            return filtered_df.head(0)
-
-    # =========================
-    # Special Price Intent (ถูกสุด/แพงสุด) -> sort ตามราคาโดยตรง
-    # =========================
-    want_cheapest = _has_any(query_lower, ["ถูกสุด", "ถูกที่สุด", "ราคาต่ำสุด", "ต่ำสุด", "cheapest", "lowest"])
-    want_expensive = _has_any(query_lower, ["แพงสุด", "แพงที่สุด", "ราคาสูงสุด", "สูงสุด", "most expensive", "highest"])
-
-    if want_cheapest:
-        result = filtered_df.sort_values(by="price_min", ascending=True)
-        picked = _select_diverse(result, top_k)
+class StoneRetriever:
+    def __init__(self, base_dir: str = BASE_DIR, csv_files: list[str] = CSV_FILES, use_snapshot: bool = True,
+                 cache_size: int = 1024, cache_ttl: float = 600.0):
+        self.base_dir = base_dir
+        self.csv_files = list(csv_files)
+        self.use_snapshot = use_snapshot
+        self.cache = QueryCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._catalog: Catalog | None = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def _build(self) -> Catalog:
+        return Catalog.load(self.base_dir, self.csv_files, use_snapshot=self.use_snapshot)
+
+    @property
+    def catalog(self) -> Catalog:
+        cat = self._catalog
+        if cat is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = self._build()
+                cat = self._catalog
+        return cat
+
+    @property
+    def version(self) -> str:
+        return self.catalog.version
+
+    def _reload(self) -> None:
+        with self._reload_lock:
+            try:
+                new_catalog = self._build()
+            except Exception as e:
+                logger.error(f"Catalog reload failed, keeping version {self._catalog and self._catalog.version}: {e}")
+                return
+            # สลับ pointer ทีเดียว: query ที่ถือ catalog เดิมอยู่ทำงานต่อจนจบได้
+            self._catalog = new_catalog
+            # key มี version อยู่แล้ว (ของเก่าไม่มีวัน hit) -> ล้างทิ้งเพื่อคืน memory
+            if self.cache is not None:
+                self.cache.clear()
+            logger.info(f"Catalog reloaded: version {new_catalog.version} ({new_catalog.n_rows} rows)")
+
+    def reload(self, background: bool = True) -> threading.Thread | None:
+        """build catalog + index ใหม่แล้วสลับแบบ atomic (background=True -> ไม่ block คนเรียก)"""
+        if not background:
+            self._reload()
+            return None
+
+        t = threading.Thread(target=self._reload, name="stone-retriever-reload", daemon=True)
+        t.start()
+        return t
+
+    def _filter_rows(self, cat: Catalog, user_query: str, stone_type: str | None):
+        """คืน (rows, budget); rows = None แปลว่าต้องคืนผลว่าง"""
+        query_lower = user_query.lower()
+
+        # 0) Stone Type + 1) Style Filter
+        base_rows = cat.base_rows(query_lower, stone_type)
+        rows = base_rows
+
+        # 2) Budget Filter (ถ้างบแล้วว่าง -> คืนว่างทันที)
+        budget = extract_budget(user_query)
+        budget_applied = False
+        if budget:
+            budget_applied = True
+            rows = cat.price_index.within(rows, hi=budget)
+
+        # 3) Outdoor Filter
+        want_outdoor = _has_any(query_lower, ["ภายนอก", "outdoor"])
+        if want_outdoor and cat.outdoor_posting is not None:
+            rows = _intersect(rows, cat.outdoor_posting)
+
+        # 4) Floor Filter
+        want_floor = _has_any(query_lower, ["ปูพื้น", "floor"])
+        if want_floor and cat.use_postings is not None:
+            rows = _intersect(rows, cat.use_postings["floor"])
+
+        # fallback เฉพาะกรณีไม่มีงบ
+        if len(rows) == 0:
+            if budget_applied:
+                return None, budget
+
+            rows = base_rows
+            if len(rows) == 0:
+                return None, budget
+
+        return rows, budget
+
+    def _pick(self, cat: Catalog, ranked, total: int, top_k: int, diversity: dict | None,
+              mmr_lambda: float | None, relevance: np.ndarray | None = None) -> tuple[list[int], list[int]]:
+        """diversity stage: คืน (row ids, อันดับใน ranked) ของตัวที่เลือก"""
+        if mmr_lambda is None:
+            return _select_diverse(cat, ranked, top_k, diversity=diversity, total=total)
+
+        # MMR: ใช้เฉพาะหัวแถว MMR_POOL อันดับแรก (relevance จาก score หรือจากอันดับถ้าไม่มี)
+        pool = max(top_k * 10, MMR_POOL)
+        pool_ids = np.fromiter(itertools.islice(ranked, pool), dtype=np.int64)
+        if relevance is None:
+            rel = 1.0 - np.arange(len(pool_ids)) / max(len(pool_ids), 1)
+        else:
+            rel = relevance[:len(pool_ids)]
+        ranks = _select_mmr(cat, pool_ids, rel, top_k, mmr_lambda)
+        return pool_ids[ranks].tolist(), ranks
+
+    def _pick_by_price(self, cat: Catalog, rows: np.ndarray, price_intent: str, top_k: int,
+                       diversity: dict | None, mmr_lambda: float | None) -> pd.DataFrame:
+        # Special Price Intent (ถูกสุด/แพงสุด) -> อ่านตามลำดับจาก price index โดยตรง (ไม่ sort)
+        ranked = cat.price_index.iter_ranked(rows, descending=price_intent == "expensive")
+        ids, _ = self._pick(cat, ranked, len(rows), top_k, diversity, mmr_lambda)
+        picked = cat.take(ids)
         picked.attrs["confidence"] = None
         return picked
 
-    if want_expensive:
-        result = filtered_df.sort_values(by="price_min", ascending=False)
-        picked = _select_diverse(result, top_k)
-        picked.attrs["confidence"] = None
+    def _rank(self, cat: Catalog, rows: np.ndarray, budget: int | None, similarity: np.ndarray,
+              intent_vec: np.ndarray, want_outdoor: bool, top_k: int,
+              diversity: dict | None, mmr_lambda: float | None) -> pd.DataFrame:
+        # =========================
+        # Similarity + Rule Scoring (ADVANCED RANKING)
+        # =========================
+        # usage score (จำนวน intent การใช้งานที่ตรง)
+        usage_score = cat.use_flags[rows] @ intent_vec
+
+        # outdoor score
+        outdoor_score = cat.outdoor_flags[rows] if want_outdoor else np.zeros(len(rows))
+
+        # budget closeness score (ถ้ามีงบ)
+        budget_score = np.zeros(len(rows))
+        if budget:
+            diff = np.clip(budget - cat.price_min[rows], 0, None)
+            denom = diff.max() if diff.max() > 0 else 1
+            budget_score = 1 - (diff / denom)
+
+        # ✅ final score (ปรับน้ำหนักได้)
+        final_score = (
+            similarity * 0.55
+            + usage_score * 0.25
+            + outdoor_score * 0.10
+            + budget_score * 0.10
+        )
+
+        order = np.argsort(-final_score, kind="stable")
+
+        # confidence (ต่างคะแนน top1-top2)
+        top_scores = final_score[order[:2]].tolist()
+        confidence = (top_scores[0] - top_scores[1]) if len(top_scores) > 1 else (top_scores[0] if top_scores else 0.0)
+
+        ids, ranks = self._pick(
+            cat, rows[order], len(rows), top_k, diversity, mmr_lambda, relevance=final_score[order]
+        )
+        sel = order[ranks]
+        picked = cat.take(ids).assign(
+            similarity=similarity[sel],
+            usage_score=usage_score[sel],
+            outdoor_score=outdoor_score[sel],
+            budget_score=budget_score[sel],
+            final_score=final_score[sel],
+        )
+        picked.attrs["confidence"] = float(confidence) if confidence is not None else None
         return picked
 
-    # =========================
-    # Similarity + Rule Scoring (ADVANCED RANKING)
-    # =========================
-    temp_vectors = vectorizer.transform(filtered_df["combined_text"])
-    query_vec = vectorizer.transform([user_query])
-    similarity = cosine_similarity(query_vec, temp_vectors).flatten()
-
-    filtered_df = filtered_df.copy()
-    filtered_df["similarity"] = similarity
-
-    intent = parse_intent(user_query)
-
-    # usage score
-    usage_score = pd.Series(0.0, index=filtered_df.index)
-    if "popular_use" in filtered_df.columns:
-        pu = filtered_df["popular_use"].astype(str).str.lower()
-        if intent["want_kitchen"]:
-            usage_score += pu.str.contains("counter|kitchen|island", na=False).astype(float) * 1.0
-        if intent["want_floor"]:
-            usage_score += pu.str.contains("floor", na=False).astype(float) * 1.0
-        if intent["want_wall"]:
-            usage_score += pu.str.contains("wall|cladding", na=False).astype(float) * 1.0
-
-    # outdoor score
-    outdoor_score = pd.Series(0.0, index=filtered_df.index)
-    if intent["want_outdoor"] and "indoor_outdoor" in filtered_df.columns:
-        io = filtered_df["indoor_outdoor"].astype(str).str.lower()
-        outdoor_score += io.isin(["outdoor", "both"]).astype(float) * 1.0
-
-    # budget closeness score (ถ้ามีงบ)
-    budget_score = pd.Series(0.0, index=filtered_df.index)
-    if budget:
-        diff = (budget - filtered_df["price_min"]).clip(lower=0)
-        denom = diff.max() if diff.max() > 0 else 1
-        budget_score = 1 - (diff / denom)
-
-    filtered_df["usage_score"] = usage_score
-    filtered_df["outdoor_score"] = outdoor_score
-    filtered_df["budget_score"] = budget_score
-
-    # ✅ final score (ปรับน้ำหนักได้)
-    filtered_df["final_score"] = (
-        filtered_df["similarity"] * 0.55
-        + usage_score * 0.25
-        + outdoor_score * 0.10
-        + budget_score * 0.10
+    def retrieve_stones(self, user_query: str, top_k: int = 3, stone_type: str | None = None,
+                        diversity: dict | None = None, mmr_lambda: float | None = None) -> pd.DataFrame:
+        key = None
+        if self.cache is not None:
+            key = query_signature(self.catalog, user_query, top_k, stone_type, diversity, mmr_lambda)
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+
+        result = self.retrieve_stones_batch(
+            [user_query], top_k=top_k, stone_type=stone_type, diversity=diversity, mmr_lambda=mmr_lambda
+        )[0]
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def retrieve_stones_batch(self, queries: list[str], top_k: int = 3, stone_type: str | None = None,
+                              diversity: dict | None = None, mmr_lambda: float | None = None) -> list[pd.DataFrame]:
+        """retrieve หลาย query พร้อมกัน: transform ครั้งเดียว + sparse matmul ครั้งเดียว
+
+        ไม่ผ่าน QueryCache (งาน batch/offline จะไล่ cache ของ traffic จริงทิ้งหมด)
+        """
+        cat = self.catalog
+        queries = list(queries)
+        if not queries:
+            return []
+
+        # similarity ของทุก query กับทุก doc (sparse: query x doc)
+        sims = (cat.vectorizer.transform(queries) @ cat.term_doc).tocsr()
+
+        # intent ของทุก query -> matrix (query x intent) ใช้คูณกับ use_flags
+        intents = [parse_intent(q) for q in queries]
+        intent_matrix = np.array(
+            [[1.0 if it[f"want_{key}"] else 0.0 for key in USE_PATTERNS] for it in intents]
+        ).reshape(len(queries), len(USE_PATTERNS))
+
+        results = []
+        for i, user_query in enumerate(queries):
+            rows, budget = self._filter_rows(cat, user_query, stone_type)
+            if rows is None:
+                results.append(cat.take([]))
+                continue
+
+            price_intent = parse_price_intent(user_query.lower())
+            if price_intent:
+                results.append(self._pick_by_price(cat, rows, price_intent, top_k, diversity, mmr_lambda))
+                continue
+
+            similarity = _gather_similarity(sims, i, rows)
+            results.append(
+                self._rank(
+                    cat, rows, budget, similarity, intent_matrix[i], intents[i]["want_outdoor"], top_k,
+                    diversity, mmr_lambda,
+                )
+            )
+        return results
+
+_default_retriever: StoneRetriever | None = None
+_default_lock = threading.Lock()
+
+def get_retriever() -> StoneRetriever:
+    """retriever ตัวกลางของ process (สร้างตอนเรียกครั้งแรก ไม่ใช่ตอน import)"""
+    global _default_retriever
+    if _default_retriever is None:
+        with _default_lock:
+            if _default_retriever is None:
+                _default_retriever = StoneRetriever()
+    return _default_retriever
+
+def reset_retriever() -> None:
+    """ทิ้ง retriever ตัวกลาง (สร้างใหม่ตอนเรียก get_retriever ครั้งถัดไป)"""
+    global _default_retriever
+    with _default_lock:
+        _default_retriever = None
+
+def retrieve_stones(user_query: str, top_k: int = 3, stone_type: str | None = None,
+                    diversity: dict | None = None, mmr_lambda: float | None = None) -> pd.DataFrame:
+    return get_retriever().retrieve_stones(
+        user_query, top_k=top_k, stone_type=stone_type, diversity=diversity, mmr_lambda=mmr_lambda
     )
 
-    result = filtered_df.sort_values(by="final_score", ascending=False)
-
-    # confidence (ต่างคะแนน top1-top2)
-    top_scores = result["final_score"].head(2).tolist()
-    confidence = (top_scores[0] - top_scores[1]) if len(top_scores) > 1 else (top_scores[0] if top_scores else 0.0)
-
-    picked = _select_diverse(result, top_k)
-    picked.attrs["confidence"] = float(confidence) if confidence is not None else None
-    return picked
-
-
-
-
-
-
-
-
-
+def retrieve_stones_batch(queries: list[str], top_k: int = 3, stone_type: str | None = None,
+                          diversity: dict | None = None, mmr_lambda: float | None = None) -> list[pd.DataFrame]:
+    return get_retriever().retrieve_stones_batch(
+        queries, top_k=top_k, stone_type=stone_type, diversity=diversity, mmr_lambda=mmr_lambda
+    )
 
+def __getattr__(name: str):
+    # ของเดิมเรียก rag_system.df / vectorizer / doc_matrix ได้ -> โหลด lazy ผ่าน retriever ตัวกลาง
+    if name in ("df", "vectorizer", "doc_matrix"):
+        return getattr(get_retriever().catalog, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    key = catalog_hash()
+    df, _, _ = build_snapshot(key=key)
+    print(f"Catalog snapshot: {snapshot_path(key=key)} ({len(df)} rows)")
@@ -0,0 +1,247 @@
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+MODEL_NAME = "models/gemini-2.0-flash"
+
+
+# ==========================================================
+# MEMORY ACCOUNTING (ประมาณขนาดของ object ใน memory แบบคร่าว ๆ)
+# ==========================================================
+_OPAQUE = (type, type(sys), type(len), type(lambda: 0), threading.Thread)
+
+
+def estimate_size(obj: Any, _seen: set | None = None, _depth: int = 0) -> int:
+    """ขนาดโดยประมาณ (bytes) รวม object ลูก; numpy/scipy/pandas ใช้ขนาด buffer จริง"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen or isinstance(obj, _OPAQUE):
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes if obj.base is None else 0  # view ไม่นับซ้ำ
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):  # DataFrame
+        return int(obj.memory_usage(deep=True).sum())
+    if all(hasattr(obj, a) for a in ("data", "indices", "indptr")):  # scipy CSR/CSC
+        return sum(estimate_size(getattr(obj, a), seen, _depth + 1) for a in ("data", "indices", "indptr"))
+
+    size = sys.getsizeof(obj, 0)
+    if _depth >= 8 or isinstance(obj, (str, bytes, int, float)):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(
+            estimate_size(k, seen, _depth + 1) + estimate_size(v, seen, _depth + 1) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(v, seen, _depth + 1) for v in obj)
+    if hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), seen, _depth + 1)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += estimate_size(getattr(obj, slot), seen, _depth + 1)
+    return size
+
+
+# ==========================================================
+# REGISTRY (singleton ต่อ process ใช้ร่วมกันทุก session / ทุก request)
+# ==========================================================
+@dataclass
+class Resource:
+    name: str
+    factory: Callable[[], Any] | None             # None = resource ที่จัดการ cache เอง (ลงทะเบียนไว้เพื่อวัด/ล้าง)
+    on_invalidate: Callable[[Any], None] | None = None
+    sizer: Callable[[Any], int] | None = None
+    value: Any = None
+    built: bool = False
+    built_at: float = 0.0
+    build_seconds: float = 0.0
+
+
+class ResourceRegistry:
+    """
+    ของหนัก ๆ ที่ควรสร้างครั้งเดียวต่อ process (model client, catalog, index)
+    - get(name): สร้างตอนเรียกครั้งแรก (lock ต่อ resource) แล้วคืนตัวเดิมตลอด
+    - invalidate(name): ทิ้งตัวเดิม (เรียก on_invalidate) ให้สร้างใหม่รอบถัดไป (ชื่อที่ยังไม่ลงทะเบียน = ข้าม)
+    - report(): ขนาดใน memory / เวลาที่ใช้สร้าง ของแต่ละตัว
+    """
+
+    def __init__(self):
+        self._entries: dict[str, Resource] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any] | None,
+                 on_invalidate: Callable[[Any], None] | None = None,
+                 sizer: Callable[[Any], int] | None = None) -> None:
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = Resource(name, factory, on_invalidate, sizer)
+                self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        entry = self._entries[name]
+        if entry.built:
+            return entry.value
+
+        with self._locks[name]:
+            if not entry.built:
+                start = time.perf_counter()
+                entry.value = entry.factory() if entry.factory else None
+                entry.build_seconds = time.perf_counter() - start
+                entry.built_at = time.time()
+                entry.built = True
+            return entry.value
+
+    def invalidate(self, name: str | None = None) -> list[str]:
+        # resource ลงทะเบียนตอนใช้ครั้งแรก -> ยังไม่เคยใช้ก็ไม่มีอะไรต้องล้าง
+        names = [n for n in ([name] if name else list(self._entries)) if n in self._entries]
+        for n in names:
+            entry = self._entries[n]
+            with self._locks[n]:
+                if entry.on_invalidate is not None:
+                    entry.on_invalidate(entry.value)
+                entry.value = None
+                entry.built = False
+        return names
+
+    def report(self) -> list[dict]:
+        rows = []
+        for entry in self._entries.values():
+            if entry.factory is not None and not entry.built:
+                continue
+            sizer = entry.sizer or estimate_size
+            rows.append({
+                "name": entry.name,
+                "bytes": sizer(entry.value),
+                "built_at": entry.built_at,
+                "build_seconds": round(entry.build_seconds, 4),
+            })
+        return rows
+
+
+registry = ResourceRegistry()
+
+
+# ==========================================================
+# RESOURCES ของแอป
+# ==========================================================
+def get_gemini_client(api_key: str):
+    """GeminiClient ตัวเดียวของ process (genai.configure / สร้าง model แค่ครั้งแรก)"""
+
+    def build():
+        import google.generativeai as genai
+
+        from gemini_client import GeminiClient
+
+        genai.configure(api_key=api_key)
+        return GeminiClient(
+            genai.GenerativeModel(MODEL_NAME),
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 4)),
+            requests_per_minute=float(os.getenv("GEMINI_RPM", 60)),
+            timeout=float(os.getenv("GEMINI_TIMEOUT", 60)),
+            max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 4)),
+        )
+
+    registry.register("gemini_client", build)
+    return registry.get("gemini_client")
+
+
+def get_prefix_cache():
+    """
+    prefix cache ของ catalog ("local" = system instruction, "provider" = context caching ของ Gemini
+    สำหรับ catalog ที่ใหญ่เกินขั้นต่ำของ provider, "off" = None ส่ง prompt ก้อนเดียวแบบเดิม)
+    ต้องเรียก get_gemini_client ก่อน
+    """
+
+    def build():
+        import google.generativeai as genai
+
+        from context_cache import GeminiContextCache, PrefixCache
+
+        def factory(**kwargs):
+            return genai.GenerativeModel(MODEL_NAME, **kwargs)
+
+        # catalog ตอนนี้ (~4k tokens) ต่ำกว่าขั้นต่ำของ context caching -> default เป็น local
+        mode = os.getenv("GEMINI_CONTEXT_CACHE", "local")
+        if mode == "provider":
+            return GeminiContextCache(
+                MODEL_NAME, factory,
+                ttl=float(os.getenv("GEMINI_CONTEXT_CACHE_TTL", 3600)),
+                min_tokens=int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 32768)),
+            )
+        if mode == "local":
+            return PrefixCache(factory)
+        return None
+
+    registry.register("prefix_cache", build)
+    return registry.get("prefix_cache")
+
+
+def get_response_cache():
+    """SQLite cache ของคำตอบ (connection เดียวต่อ process)"""
+
+    def build():
+        from response_cache import DEFAULT_PATH, ResponseCache
+
+        return ResponseCache(
+            os.getenv("GEMINI_CACHE_PATH", DEFAULT_PATH),
+            ttl=float(os.getenv("GEMINI_CACHE_TTL", 7 * 24 * 3600)),
+            max_entries=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", 5000)),
+            bypass=os.getenv("GEMINI_CACHE_BYPASS", "") == "1",
+        )
+
+    # ไม่ปิด connection ตอน invalidate: session ที่ยังถือตัวเก่าอยู่ใช้ต่อได้จนจบ rerun
+    registry.register("response_cache", build)
+    return registry.get("response_cache")
+
+
+def get_catalog(compact: bool = False):
+    """
+    ProductContext ของ siamtak_granite.csv: product_context cache ไว้เองต่อ process
+    และอ่านใหม่เองเมื่อไฟล์เปลี่ยน (ที่นี่แค่ลงทะเบียนไว้วัดขนาด / ล้าง)
+    """
+    import product_context
+
+    registry.register(
+        "catalog",
+        None,
+        on_invalidate=lambda _: product_context.clear_cache(),
+        sizer=lambda _: estimate_size(product_context._cache) + estimate_size(product_context._index_cache),
+    )
+    registry.get("catalog")
+    return product_context.get_product_context(compact=compact)
+
+
+def get_retriever():
+    """StoneRetriever ของ rag_system (granite/marble dataset, index โหลดจาก snapshot)"""
+    import rag_system
+
+    def size(retriever):
+        cat = retriever._catalog  # ยังไม่ได้โหลด catalog = แทบไม่กิน memory
+        return estimate_size(retriever.cache) + (estimate_size(cat) if cat is not None else 0)
+
+    registry.register("retriever", rag_system.get_retriever,
+                      on_invalidate=lambda _: rag_system.reset_retriever(), sizer=size)
+    return registry.get("retriever")
+
+
+def reload_retriever(background: bool = True):
+    """
+    build catalog + index ของ retriever ใหม่แล้วสลับแบบ hot-swap (StoneRetriever.reload)
+    request ระหว่างนั้นยังใช้ catalog เดิม ไม่ต้องรอ build index ใหม่ตอนเรียกครั้งถัดไป
+    """
+    return get_retriever().reload(background=background)
+
+
+def invalidate(name: str | None = None) -> list[str]:
+    """ล้าง resource ตามชื่อ (หรือทั้งหมด) ตัวที่ถูกล้างจะสร้างใหม่ตอนเรียกใช้ครั้งถัดไป"""
+    return registry.invalidate(name)
+
+
+def memory_report() -> list[dict]:
+    return registry.report()
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+BASE_DIR = os.path.dirname(__file__)
+DEFAULT_PATH = os.path.join(BASE_DIR, ".response_cache.sqlite3")
+
+
+def normalize_question(text: str) -> str:
+    """lower + ตัดช่องว่างซ้ำ (คำถามที่ต่างกันแค่ช่องว่าง/ตัวพิมพ์ใช้คำตอบเดียวกัน)"""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def make_cache_key(model_name: str, context_version: str, question: str) -> str:
+    raw = "\x1f".join([model_name, context_version, normalize_question(question)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    cache คำตอบจาก LLM ลง SQLite (อยู่ข้าม session / restart)
+    - ttl: อายุของคำตอบ (วินาที)
+    - max_entries: เกินแล้วลบตัวที่ถูกใช้ล่าสุดนานที่สุดออก
+    - bypass: True = ไม่อ่าน/ไม่เขียน cache เลย
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 5000, bypass: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+
+    def get(self, key: str) -> str | None:
+        if self.bypass:
+            return None
+
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] + self.ttl < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model_name: str, response: str) -> None:
+        if self.bypass or not response:
+            return
+
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now),
+            )
+            # จำกัดขนาด: เก็บแค่ max_entries ตัวที่ถูกใช้ล่าสุด
+            self._conn.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            return cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"size": size, "hits": self.hits, "misses": self.misses, "bypass": self.bypass}
@@ -0,0 +1,301 @@
+"""
+Asyncio crawl engine for scrape_granite.py (--engine async).
+Each host gets its own aiohttp connection pool with a concurrency cap, keep-alive
+and a politeness rate limit, so CDN image downloads never queue behind page fetches.
+Records are identical to scrape_granite.process_product / process_product_incremental.
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from crawl_state import CrawlState, conditional_headers, content_hash
+from rate_limit import TokenBucket
+from scrape_granite import (
+    BASE_DATA_DIR, BASE_URL, HEADERS, IMAGE_CHUNK_SIZE, MAX_PENDING, ListingCrawl, ResultCallback, StreamedFile,
+    empty_product, image_target, parse_product_html,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HostLimits:
+    concurrency: int          # open connections to the host
+    rate: float               # requests per second (politeness)
+    burst: Optional[float] = None
+
+
+# Pages come from the shop itself (be polite); images from the CDN (can take more)
+SITE_LIMITS = HostLimits(concurrency=8, rate=10.0)
+CDN_LIMITS = HostLimits(concurrency=32, rate=50.0)
+
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# aiohttp manages keep-alive itself and only decodes br when Brotli is installed
+ASYNC_HEADERS = {k: v for k, v in HEADERS.items() if k != "Connection"}
+ASYNC_HEADERS["Accept-Encoding"] = "gzip, deflate"
+
+
+@dataclass
+class Fetched:
+    url: str
+    status: int
+    headers: Mapping[str, str]
+    body: bytes = b""
+    digest: Optional[str] = None    # set when the body was streamed to a file instead
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise IOError(f"{self.status} Error for url: {self.url}")
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+
+def _retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """Retry-After (seconds or HTTP date) if present, else exponential backoff with jitter."""
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                return max(0.0, min(delay, 60.0))
+            except (TypeError, ValueError):
+                pass
+    return BACKOFF_FACTOR * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+class HostPool:
+    """Connection pool + rate limit for a single host."""
+
+    def __init__(self, host: str, limits: HostLimits, timeout: float = REQUEST_TIMEOUT):
+        self.host = host
+        self.limits = limits
+        connector = aiohttp.TCPConnector(
+            limit=limits.concurrency,
+            limit_per_host=limits.concurrency,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, headers=ASYNC_HEADERS, timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+        self.bucket = TokenBucket(limits.rate, limits.burst or limits.concurrency)
+        self.requests = 0
+        self.retries = 0
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None, save_to: Optional[Path] = None,
+                  unchanged_digest: Optional[str] = None) -> Fetched:
+        """
+        GET with retries. With save_to, a 200 body is streamed in chunks to that path
+        (see StreamedFile; not rewritten if its hash equals unchanged_digest) instead of read into memory.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            self.requests += 1
+            try:
+                async with self.session.get(url, headers=headers) as resp:
+                    if save_to is not None and resp.status == 200:
+                        # file I/O in a worker thread so other fetches keep flowing while the disk is busy
+                        with await asyncio.to_thread(StreamedFile, save_to) as f:
+                            async for chunk in resp.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                                await asyncio.to_thread(f.write, chunk)
+                            digest = await asyncio.to_thread(f.commit, unchanged_digest)
+                        return Fetched(url, resp.status, resp.headers, digest=digest)
+                    body = await resp.read()
+                    if resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                        return Fetched(url, resp.status, resp.headers, body)
+                    delay = _retry_delay(resp.headers.get("Retry-After"), attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = _retry_delay(None, attempt)
+            self.retries += 1
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+class AsyncCrawler:
+    """
+    Routes each request to the pool of its host: site_host uses site_limits,
+    every other host (the image CDN) gets its own pool with cdn_limits.
+    """
+
+    def __init__(self, site_host: Optional[str] = None, site_limits: HostLimits = SITE_LIMITS,
+                 cdn_limits: HostLimits = CDN_LIMITS, timeout: float = REQUEST_TIMEOUT):
+        self.site_host = site_host or urlparse(BASE_URL).hostname
+        self.site_limits = site_limits
+        self.cdn_limits = cdn_limits
+        self.timeout = timeout
+        self._pools: Dict[str, HostPool] = {}
+
+    def pool(self, url: str) -> HostPool:
+        host = urlparse(url).hostname or ""
+        pool = self._pools.get(host)
+        if pool is None:
+            limits = self.site_limits if host == self.site_host else self.cdn_limits
+            pool = self._pools[host] = HostPool(host, limits, self.timeout)
+        return pool
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> Fetched:
+        return await self.pool(url).get(url, headers, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {h: {"requests": p.requests, "retries": p.retries} for h, p in self._pools.items()}
+
+    async def close(self) -> None:
+        await asyncio.gather(*(p.close() for p in self._pools.values()))
+
+    async def __aenter__(self) -> "AsyncCrawler":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+async def download_image(crawler: AsyncCrawler, image_url: str, save_path: Path,
+                         state: Optional[CrawlState] = None, relative_path: str = "") -> bool:
+    """Download an image; with a crawl state, conditionally and only rewriting changed files."""
+    # SQLite / filesystem calls block, run them off the event loop
+    entry = await asyncio.to_thread(state.get_image, image_url) if state else None
+    have_file = await asyncio.to_thread(save_path.exists)
+    headers = conditional_headers(entry) if state and have_file else None
+
+    try:
+        response = await crawler.get(image_url, headers, save_to=save_path,
+                                     unchanged_digest=entry["content_hash"] if entry else None)
+        if response.status == 304 and have_file:
+            return True
+        response.raise_for_status()
+
+        if state:
+            await asyncio.to_thread(state.put_image, image_url, response.headers.get("ETag"),
+                                    response.headers.get("Last-Modified"), response.digest, relative_path)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to download image {image_url}: {e}")
+        return bool(state) and have_file
+
+
+async def _ensure_image(crawler: AsyncCrawler, state: CrawlState, record: Dict[str, str],
+                        index: int, image_dir: Path) -> Dict[str, str]:
+    if record.get("image_url"):
+        image_path, relative_image_path = image_target(record["product_url"], record["image_url"], index, image_dir)
+        if not await asyncio.to_thread(image_path.exists):
+            if await download_image(crawler, record["image_url"], image_path, state, relative_image_path):
+                record = {**record, "image_path": relative_image_path}
+                await asyncio.to_thread(state.update_record, record["product_url"], record)
+    return record
+
+
+async def process_product(crawler: AsyncCrawler, product_url: str, index: int, total: int,
+                          image_dir: Path = BASE_DATA_DIR, state: Optional[CrawlState] = None
+                          ) -> Tuple[Optional[Dict[str, str]], str]:
+    """
+    Async counterpart of process_product / process_product_incremental.
+    Returns (record, status); without a crawl state every fetched page is "added".
+    """
+    entry = await asyncio.to_thread(state.get_page, product_url) if state else None
+    old = entry["record"] if entry else None
+    headers = conditional_headers(entry) if old else None
+
+    try:
+        response = await crawler.get(product_url, headers)
+        if response.status == 304 and old:
+            await asyncio.to_thread(state.touch_page, product_url)
+            return await _ensure_image(crawler, state, old, index, image_dir), "unchanged"
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Error scraping {product_url}: {e}")
+        return (old if state else empty_product(product_url)), "failed"
+
+    digest = content_hash(response.body)
+    if old and entry["content_hash"] == digest:
+        await asyncio.to_thread(state.put_page, product_url, response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"), digest, old)
+        return await _ensure_image(crawler, state, old, index, image_dir), "unchanged"
+
+    logger.info(f"Processing product {index}/{total}: {product_url}")
+    # Parsing is short and CPU-bound: run it on the loop, a thread hop buys nothing under the GIL
+    result = parse_product_html(product_url, response.text)
+    if result["image_url"]:
+        image_path, relative_image_path = image_target(product_url, result["image_url"], index, image_dir)
+        if await download_image(crawler, result["image_url"], image_path, state, relative_image_path):
+            result["image_path"] = relative_image_path
+
+    if state is None:
+        return result, "added"
+    await asyncio.to_thread(state.put_page, product_url, response.headers.get("ETag"),
+                            response.headers.get("Last-Modified"), digest, result)
+    if old is None:
+        return result, "added"
+    return result, ("unchanged" if result == old else "updated")
+
+
+async def _crawl(listing: ListingCrawl, on_result: ResultCallback, image_dir: Path,
+                 state: Optional[CrawlState], crawler: AsyncCrawler) -> None:
+    # Backpressure: at most MAX_PENDING products scheduled at a time, results are handed
+    # to on_result and dropped, so memory stays flat however large the catalog is
+    slots = asyncio.Semaphore(MAX_PENDING)
+    running = set()
+    # on_result writes the CSV: one call at a time (it is not thread-safe), off the event loop
+    writer = asyncio.Lock()
+
+    async def one(index: int, url: str) -> None:
+        try:
+            record, status = await process_product(crawler, url, index, len(listing.urls), image_dir, state)
+        except Exception as e:
+            logger.error(f"Error processing {url}: {e}")
+            record, status = None, "failed"
+        finally:
+            slots.release()
+        async with writer:
+            await asyncio.to_thread(on_result, url, record, status)
+
+    async with crawler:
+        # Listing pages are fetched one after another; every product they yield is scheduled
+        # right away and the per-host pools bound what actually runs
+        index = 0
+        while listing.next_url is not None:
+            page_url = listing.take_next()
+            try:
+                response = await crawler.get(page_url)
+                response.raise_for_status()
+            except Exception as e:
+                listing.fail(page_url, e)
+                break
+            for url in listing.feed(page_url, response.text):
+                await slots.acquire()
+                index += 1
+                task = asyncio.create_task(one(index, url))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+        if running:
+            await asyncio.gather(*running)
+        logger.info(f"Async crawl pools: {crawler.stats()}")
+
+
+def crawl_products(listing: ListingCrawl, on_result: ResultCallback, image_dir: Path = BASE_DATA_DIR,
+                   state: Optional[CrawlState] = None, site_host: Optional[str] = None,
+                   site_limits: HostLimits = SITE_LIMITS, cdn_limits: HostLimits = CDN_LIMITS) -> None:
+    """Crawl the listing and its products on a fresh event loop, calling on_result(url, record, status) per product."""
+    crawler = AsyncCrawler(site_host, site_limits, cdn_limits)
+    asyncio.run(_crawl(listing, on_result, Path(image_dir), state, crawler))
@@ -1,20 +1,27 @@
 """
 Fast Granite Scraper for Siamtak.com
-Uses requests + BeautifulSoup with concurrent processing
+Uses requests + BeautifulSoup with concurrent processing.
+Incremental mode keeps a crawl state (crawl_state.py) and only re-fetches what changed.
+--engine async switches to the asyncio crawler in scrape_async.py.
+--parser fast (default) parses product pages with lxml (fast_parser.py), bs4 with BeautifulSoup only.
 """
+import argparse
 import csv
 import logging
 import os
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import Dict, Any, List, Optional
-from urllib.parse import urljoin
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urljoin, urlparse
 
 import requests
 from bs4 import BeautifulSoup
 
+import fast_parser
+from crawl_state import STATE_PATH, CrawlState, conditional_headers, content_hash, content_hasher
+
 logger = logging.getLogger(__name__)
 
 # Configuration
@@ -22,6 +29,9 @@ BASE_URL = "https://www.siamtak.com"
 CATEGORY_URL = "https://www.siamtak.com/sub-category/granite"
 BASE_DATA_DIR = Path(__file__).resolve().parent / "data" / "granite_images"
 CSV_PATH = Path(__file__).resolve().parent / "siamtak_granite.csv"
+DELTA_CSV_PATH = Path(__file__).resolve().parent / "siamtak_granite_delta.csv"
+
+FIELDNAMES = ["product_url", "product_title", "product_description", "product_price", "image_url", "image_path"]
 
 # Request headers
 HEADERS = {
@@ -35,6 +45,12 @@ HEADERS = {
 
 # Thread pool size for concurrent requests
 MAX_WORKERS = 10
+# Safety cap on pagination / load-more pages per category
+MAX_LISTING_PAGES = 200
+# Products in flight / waiting to be written; keeps memory flat on large catalogs
+MAX_PENDING = 100
+# Images are streamed to disk in chunks of this size
+IMAGE_CHUNK_SIZE = 64 * 1024
 
 
 def create_session() -> requests.Session:
@@ -58,6 +74,22 @@ def create_session() -> requests.Session:
     return session
 
 
+def extract_product_urls(soup: BeautifulSoup, page_url: str, seen: Set[str]) -> List[str]:
+    """Product links on a listing page that are not in seen yet (seen is updated)."""
+    new_urls = []
+    
+    # Method 1: Find links in product cards
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if '/products/' in href:
+            full_url = urljoin(page_url, href)
+            if full_url not in seen:
+                seen.add(full_url)
+                new_urls.append(full_url)
+    
+    return new_urls
+
+
 def get_product_urls_from_page(session: requests.Session, url: str) -> List[str]:
     """Extract all product URLs from a category page."""
     try:
@@ -66,17 +98,7 @@ def get_product_urls_from_page(session: requests.Session, url: str) -> List[str]
         response.encoding = 'utf-8'
         
         soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find all product links
-        product_urls = []
-        
-        # Method 1: Find links in product cards
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if '/products/' in href:
-                full_url = urljoin(BASE_URL, href)
-                if full_url not in product_urls:
-                    product_urls.append(full_url)
+        product_urls = extract_product_urls(soup, url, set())
         
         logger.info(f"Found {len(product_urls)} product URLs from {url}")
         return product_urls
@@ -86,31 +108,99 @@ def get_product_urls_from_page(session: requests.Session, url: str) -> List[str]
         return []
 
 
-def check_for_more_pages(session: requests.Session, soup: BeautifulSoup) -> Optional[str]:
+def check_for_more_pages(session: Optional[requests.Session], soup: BeautifulSoup,
+                         base_url: str = BASE_URL) -> Optional[str]:
     """Check if there's a 'Load More' or pagination link."""
     # Check for pagination
     pagination = soup.find('nav', class_='pagination')
     if pagination:
         next_link = pagination.find('a', string=re.compile(r'Next|ถัดไป|>'))
         if next_link and next_link.get('href'):
-            return urljoin(BASE_URL, next_link['href'])
+            return urljoin(base_url, next_link['href'])
     
     # Check for load more button (Finsweet CMS Load)
     load_more = soup.find(attrs={'fs-cmsload-element': 'load-more'})
     if load_more and load_more.name == 'a' and load_more.get('href'):
-        return urljoin(BASE_URL, load_more['href'])
+        return urljoin(base_url, load_more['href'])
     
     return None
 
 
+class ListingCrawl:
+    """
+    Walks a category through its pagination / Finsweet load-more links.
+    feed() parses one listing page and returns the product URLs not seen before,
+    so detail fetches can start while later listing pages are still loading.
+    The fetching itself is done by crawl() (requests) or by scrape_async.
+    """
+    
+    def __init__(self, category_url: str, max_pages: int = MAX_LISTING_PAGES):
+        self.category_url = category_url
+        self.max_pages = max_pages
+        self.next_url: Optional[str] = category_url
+        self.urls: List[str] = []          # listing order
+        self.pages = 0
+        self.complete = False              # True only if the last page was reached without errors
+        self._seen: Set[str] = set()
+        self._visited: Set[str] = set()
+    
+    def take_next(self) -> Optional[str]:
+        url, self.next_url = self.next_url, None
+        if url is not None:
+            self._visited.add(url)
+        return url
+    
+    def feed(self, page_url: str, raw_html: str) -> List[str]:
+        soup = BeautifulSoup(raw_html, 'html.parser')
+        new_urls = extract_product_urls(soup, page_url, self._seen)
+        self.urls.extend(new_urls)
+        self.pages += 1
+        logger.info(f"Listing page {self.pages}: {len(new_urls)} new product URLs from {page_url}")
+        
+        next_url = check_for_more_pages(None, soup, page_url)
+        if next_url is None or next_url in self._visited:
+            self.complete = True
+        elif self.pages >= self.max_pages:
+            logger.warning(f"Stopping after {self.pages} listing pages (max_pages)")
+        else:
+            self.next_url = next_url
+        return new_urls
+    
+    def fail(self, page_url: str, error: Exception) -> None:
+        logger.error(f"Error fetching product URLs from {page_url}: {error}")
+    
+    def crawl(self, session: requests.Session) -> Iterator[str]:
+        """Yield new product URLs page by page."""
+        while self.next_url is not None:
+            url = self.take_next()
+            try:
+                response = session.get(url, timeout=30)
+                response.raise_for_status()
+                response.encoding = 'utf-8'
+            except Exception as e:
+                self.fail(url, e)
+                return
+            yield from self.feed(url, response.text)
+
+
 def scrape_product_detail(session: requests.Session, product_url: str) -> Dict[str, str]:
     """
     Scrape detailed information from a product page.
     Returns product details including full description.
     """
-    import html
-    
-    result = {
+    try:
+        response = session.get(product_url, timeout=30)
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+    except Exception as e:
+        logger.warning(f"Error scraping {product_url}: {e}")
+        return empty_product(product_url)
+
+    return parse_product_html(product_url, response.text)
+
+
+def empty_product(product_url: str) -> Dict[str, str]:
+    return {
         "product_url": product_url,
         "product_title": "",
         "product_description": "",
@@ -118,14 +208,33 @@ def scrape_product_detail(session: requests.Session, product_url: str) -> Dict[s
         "image_url": "",
         "image_path": ""
     }
+
+
+def parse_product_html(product_url: str, raw_html: str, backend: Optional[str] = None) -> Dict[str, str]:
+    """
+    Extract title, description, price and image URL from a product page's HTML.
+    backend "fast" (default when lxml is installed) tries the targeted lxml spec in
+    fast_parser.py first and falls back to the BeautifulSoup heuristics when it misses.
+    """
+    if (backend or fast_parser.get_backend()) == "fast" and fast_parser.available():
+        try:
+            result = fast_parser.extract(product_url, raw_html)
+        except Exception as e:
+            logger.debug(f"Fast parser failed on {product_url}: {e}")
+            result = None
+        if result is not None:
+            return result
+    return parse_product_html_soup(product_url, raw_html)
+
+
+def parse_product_html_soup(product_url: str, raw_html: str) -> Dict[str, str]:
+    """BeautifulSoup heuristics: broad selectors and regex scans over the raw HTML."""
+    import html
+    
+    result = empty_product(product_url)
     
     try:
-        response = session.get(product_url, timeout=30)
-        response.raise_for_status()
-        response.encoding = 'utf-8'
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        raw_html = response.text
+        soup = BeautifulSoup(raw_html, 'html.parser')
         
         # Extract title
         title_elem = (
@@ -225,22 +334,62 @@ def scrape_product_detail(session: requests.Session, product_url: str) -> Dict[s
         logger.debug(f"Scraped: {result['product_title'][:50] if result['product_title'] else product_url}")
         
     except Exception as e:
-        logger.warning(f"Error scraping {product_url}: {e}")
+        logger.warning(f"Error parsing {product_url}: {e}")
     
     return result
 
 
+class StreamedFile:
+    """
+    Download target written chunk by chunk to <path>.part while hashing the body.
+    commit() renames it over path (readers never see half an image); leaving the
+    block without commit() removes the partial file.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.part = self.path.with_name(self.path.name + ".part")
+        self._file = open(self.part, 'wb')
+        self._hasher = content_hasher()
+        self._done = False
+    
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._hasher.update(chunk)
+    
+    def commit(self, unchanged_digest: Optional[str] = None) -> str:
+        """Move the download into place (skipped if its hash equals unchanged_digest) and return the hash."""
+        self._file.close()
+        digest = self._hasher.hexdigest()
+        if digest == unchanged_digest and self.path.exists():
+            self.part.unlink()
+        else:
+            os.replace(self.part, self.path)
+        self._done = True
+        return digest
+    
+    def __enter__(self) -> "StreamedFile":
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        if not self._done:
+            self._file.close()
+            self.part.unlink(missing_ok=True)
+
+
 def download_image(session: requests.Session, image_url: str, save_path: Path) -> bool:
-    """Download image from URL and save to path."""
+    """Download image from URL and stream it to path."""
     if not image_url:
         return False
     
     try:
-        response = session.get(image_url, timeout=15)
-        response.raise_for_status()
-        
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
+        with session.get(image_url, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            
+            with StreamedFile(save_path) as f:
+                for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                    f.write(chunk)
+                f.commit()
         
         return True
     except Exception as e:
@@ -248,7 +397,27 @@ def download_image(session: requests.Session, image_url: str, save_path: Path) -
         return False
 
 
-def process_product(session: requests.Session, product_url: str, index: int, total: int) -> Dict[str, str]:
+def image_target(product_url: str, image_url: str, index: int, image_dir: Path = BASE_DATA_DIR) -> Tuple[Path, str]:
+    """Local file path and CSV image_path for a product image."""
+    # Create filename from URL slug
+    slug = product_url.rstrip('/').split('/')[-1] or f"product_{index}"
+    slug = re.sub(r'[^\w\-]', '', slug)
+    
+    # Determine image extension
+    ext = '.jpg'
+    if '.png' in image_url.lower():
+        ext = '.png'
+    elif '.webp' in image_url.lower():
+        ext = '.webp'
+    
+    image_filename = f"{slug}{ext}"
+    if Path(image_dir) == BASE_DATA_DIR:
+        return BASE_DATA_DIR / image_filename, os.path.join("data", "granite_images", image_filename)
+    return Path(image_dir) / image_filename, str(Path(image_dir) / image_filename)
+
+
+def process_product(session: requests.Session, product_url: str, index: int, total: int,
+                    image_dir: Path = BASE_DATA_DIR) -> Dict[str, str]:
     """Process a single product: scrape details and download image."""
     logger.info(f"Processing product {index}/{total}: {product_url}")
     
@@ -257,103 +426,383 @@ def process_product(session: requests.Session, product_url: str, index: int, tot
     
     # Download image
     if result["image_url"]:
-        # Create filename from URL slug
-        slug = product_url.split('/')[-1] or f"product_{index}"
-        slug = re.sub(r'[^\w\-]', '', slug)
-        
-        # Determine image extension
-        ext = '.jpg'
-        if '.png' in result["image_url"].lower():
-            ext = '.png'
-        elif '.webp' in result["image_url"].lower():
-            ext = '.webp'
-        
-        image_filename = f"{slug}{ext}"
-        image_path = BASE_DATA_DIR / image_filename
-        relative_image_path = os.path.join("data", "granite_images", image_filename)
-        
+        image_path, relative_image_path = image_target(product_url, result["image_url"], index, image_dir)
         if download_image(session, result["image_url"], image_path):
             result["image_path"] = relative_image_path
     
     return result
 
 
-def run_granite_scrape() -> Dict[str, Any]:
+def download_image_incremental(session: requests.Session, state: CrawlState, image_url: str,
+                               save_path: Path, relative_path: str) -> bool:
+    """
+    Download an image only if it changed since the last run.
+    Sends If-None-Match / If-Modified-Since when the file is already on disk and
+    skips rewriting it when the body hash matches the stored one.
+    """
+    entry = state.get_image(image_url)
+    have_file = save_path.exists()
+    headers = conditional_headers(entry) if have_file else {}
+    
+    try:
+        with session.get(image_url, timeout=15, headers=headers, stream=True) as response:
+            if response.status_code == 304 and have_file:
+                return True
+            response.raise_for_status()
+            
+            with StreamedFile(save_path) as f:
+                for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                    f.write(chunk)
+                digest = f.commit(unchanged_digest=entry["content_hash"] if entry else None)
+        state.put_image(image_url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                        digest, relative_path)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to download image {image_url}: {e}")
+        return have_file
+
+
+def process_product_incremental(session: requests.Session, state: CrawlState, product_url: str,
+                                index: int, total: int, image_dir: Path = BASE_DATA_DIR
+                                ) -> Tuple[Optional[Dict[str, str]], str]:
+    """
+    Conditionally re-fetch a product page.
+    Returns (record, status) with status one of added / updated / unchanged / failed.
+    Unchanged pages (304 or same body hash) reuse the stored record and skip the image.
+    """
+    entry = state.get_page(product_url)
+    old = entry["record"] if entry else None
+    headers = conditional_headers(entry) if old else {}
+    
+    try:
+        response = session.get(product_url, timeout=30, headers=headers)
+        if response.status_code == 304 and old:
+            state.touch_page(product_url)
+            return _ensure_image(session, state, old, index, image_dir), "unchanged"
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+    except Exception as e:
+        logger.warning(f"Error scraping {product_url}: {e}")
+        return old, "failed"
+    
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    digest = content_hash(response.content)
+    if old and entry["content_hash"] == digest:
+        state.put_page(product_url, etag, last_modified, digest, old)
+        return _ensure_image(session, state, old, index, image_dir), "unchanged"
+    
+    logger.info(f"Changed product {index}/{total}: {product_url}")
+    result = parse_product_html(product_url, response.text)
+    if result["image_url"]:
+        image_path, relative_image_path = image_target(product_url, result["image_url"], index, image_dir)
+        if download_image_incremental(session, state, result["image_url"], image_path, relative_image_path):
+            result["image_path"] = relative_image_path
+    
+    state.put_page(product_url, etag, last_modified, digest, result)
+    if old is None:
+        return result, "added"
+    # Body changed but extracted fields did not (e.g. rotating tokens in the HTML)
+    return result, ("unchanged" if result == old else "updated")
+
+
+def _ensure_image(session: requests.Session, state: CrawlState, record: Dict[str, str],
+                  index: int, image_dir: Path) -> Dict[str, str]:
+    """Re-download the image of an unchanged page only if the local file went missing."""
+    if record.get("image_url"):
+        image_path, relative_image_path = image_target(record["product_url"], record["image_url"], index, image_dir)
+        if not image_path.exists():
+            if download_image_incremental(session, state, record["image_url"], image_path, relative_image_path):
+                record = {**record, "image_path": relative_image_path}
+                state.update_record(record["product_url"], record)
+    return record
+
+
+class CsvStream:
+    """
+    CSV written row by row to <path>.part and atomically renamed over path by commit().
+    Rows are flushed as they are written, so a crashed run leaves its completed
+    rows in the .part file while readers keep seeing the previous CSV.
+    """
+    
+    def __init__(self, path: Path, fieldnames: List[str] = FIELDNAMES):
+        self.path = Path(path)
+        self.part = self.path.with_name(self.path.name + ".part")
+        self.count = 0
+        self._file = open(self.part, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        self._writer.writeheader()
+    
+    def write(self, row: Dict[str, str]) -> None:
+        self._writer.writerow(row)
+        self._file.flush()
+        self.count += 1
+    
+    def commit(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.part, self.path)
+    
+    def discard(self) -> None:
+        self._file.close()
+        self.part.unlink(missing_ok=True)
+    
+    def close(self) -> None:
+        """Stop writing without publishing (keeps the .part file)."""
+        if not self._file.closed:
+            self._file.close()
+
+
+def write_csv(path: Path, rows: Iterable[Dict[str, str]], fieldnames: List[str] = FIELDNAMES) -> int:
+    out = CsvStream(path, fieldnames)
+    try:
+        for row in rows:
+            out.write(row)
+        out.commit()
+    finally:
+        out.close()
+    return out.count
+
+
+ResultCallback = Callable[[str, Optional[Dict[str, str]], str], None]
+
+
+def _scrape_products(session: requests.Session, listing: ListingCrawl, image_dir: Path, on_result: ResultCallback,
+                     state: Optional[CrawlState] = None, engine: str = "threads") -> None:
+    """
+    Crawl the listing and fetch every product with the chosen engine.
+    Detail fetches are submitted as soon as a listing page yields new URLs and
+    on_result(url, record, status) is called as each product finishes; at most
+    MAX_PENDING products are in flight, so memory does not grow with the catalog.
+    """
+    if engine == "async":
+        from scrape_async import crawl_products
+        
+        crawl_products(listing, on_result, image_dir, state, site_host=urlparse(listing.category_url).hostname)
+        return
+    
+    pending = {}
+    
+    def deliver(done) -> None:
+        for future in done:
+            url = pending.pop(future)
+            try:
+                outcome = future.result()
+                record, status = outcome if state is not None else (outcome, "added")
+            except Exception as e:
+                logger.error(f"Error processing {url}: {e}")
+                record, status = None, "failed"
+            on_result(url, record, status)
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for index, url in enumerate(listing.crawl(session), 1):
+            if state is None:
+                future = executor.submit(process_product, session, url, index, len(listing.urls), image_dir)
+            else:
+                future = executor.submit(process_product_incremental, session, state, url, index,
+                                         len(listing.urls), image_dir)
+            pending[future] = url
+            
+            deliver([f for f in pending if f.done()])
+            if len(pending) >= MAX_PENDING:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                deliver(done)
+        
+        for future in as_completed(list(pending)):
+            deliver([future])
+
+
+def run_granite_scrape(incremental: bool = False, category_url: str = CATEGORY_URL, csv_path: Path = CSV_PATH,
+                       image_dir: Path = BASE_DATA_DIR, state_path: Path = STATE_PATH,
+                       delta_path: Path = DELTA_CSV_PATH, engine: str = "threads") -> Dict[str, Any]:
     """
     Main function to run the granite scraper.
     Uses concurrent processing for faster execution.
+    
+    By default every product is fetched and csv_path is rewritten (no crawl state).
+    incremental=True (opt in, CLI --incremental) keeps a crawl state in SQLite at state_path:
+    pages and images are fetched with conditional GETs, unchanged ones are skipped, changed
+    rows are written to delta_path, csv_path is only rewritten when something changed, and
+    the result dict also carries a "changes" summary.
+    engine="threads" uses a ThreadPoolExecutor over one requests session,
+    engine="async" uses scrape_async (per-host aiohttp pools with rate limits).
+    Rows are streamed to <csv>.part and renamed into place at the end.
     """
+    if engine not in ("threads", "async"):
+        raise ValueError(f"Unknown engine: {engine}")
+    if incremental:
+        return _run_incremental(category_url, Path(csv_path), Path(image_dir), Path(state_path), Path(delta_path),
+                                engine)
+    
     start_time = time.time()
+    out = None
     
     try:
-        logger.info(f"Starting granite scrape for {CATEGORY_URL}")
+        logger.info(f"Starting granite scrape for {category_url}")
         
         # Ensure directories exist
-        BASE_DATA_DIR.mkdir(parents=True, exist_ok=True)
+        Path(image_dir).mkdir(parents=True, exist_ok=True)
         
         # Create session
         session = create_session()
         
-        # Step 1: Get all product URLs from category page
-        logger.info("Step 1: Fetching product URLs...")
-        product_urls = get_product_urls_from_page(session, CATEGORY_URL)
+        # Step 1+2: Follow listing pages, scrape products as their URLs come in
+        # and write each one to the CSV as soon as it is done
+        logger.info(f"Step 1: Crawling listing pages and products ({engine} engine)...")
+        listing = ListingCrawl(category_url)
+        out = CsvStream(Path(csv_path))
         
-        if not product_urls:
+        def on_result(url: str, record: Optional[Dict[str, str]], status: str) -> None:
+            if record is not None:
+                out.write(record)
+        
+        _scrape_products(session, listing, Path(image_dir), on_result, engine=engine)
+        
+        if not listing.urls:
+            out.discard()
             logger.warning("No product URLs found")
             return {"success": False, "message": "No product URLs found"}
         
-        # Step 2: Scrape each product concurrently
-        logger.info(f"Step 2: Scraping {len(product_urls)} products with {MAX_WORKERS} workers...")
-        results = []
-        
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {
-                executor.submit(process_product, session, url, i+1, len(product_urls)): url
-                for i, url in enumerate(product_urls)
-            }
-            
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as e:
-                    url = futures[future]
-                    logger.error(f"Error processing {url}: {e}")
-        
-        if not results:
+        if not out.count:
+            out.discard()
             logger.warning("No products were successfully scraped")
             return {"success": False, "message": "No products successfully scraped"}
         
-        # Step 3: Save results to CSV
+        # Step 3: Publish the CSV
         logger.info("Step 3: Saving results to CSV...")
-        with open(CSV_PATH, "w", encoding="utf-8-sig", newline="") as f:
-            fieldnames = ["product_url", "product_title", "product_description", "product_price", "image_url", "image_path"]
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
+        out.commit()
         
         elapsed_time = time.time() - start_time
         
-        logger.info(f"Successfully scraped {len(results)} granite products in {elapsed_time:.2f} seconds")
-        logger.info(f"Results saved to: {CSV_PATH}")
+        logger.info(f"Successfully scraped {out.count} granite products in {elapsed_time:.2f} seconds")
+        logger.info(f"Results saved to: {csv_path}")
         
         return {
             "success": True,
-            "message": f"Successfully scraped {len(results)} products in {elapsed_time:.2f} seconds",
-            "count": len(results),
-            "csv_path": str(CSV_PATH),
-            "image_dir": str(BASE_DATA_DIR),
+            "message": f"Successfully scraped {out.count} products in {elapsed_time:.2f} seconds",
+            "count": out.count,
+            "csv_path": str(csv_path),
+            "image_dir": str(image_dir),
             "elapsed_time": round(elapsed_time, 2)
         }
         
     except Exception as e:
         logger.error(f"Scrape failed: {e}")
+        if out is not None:
+            logger.error(f"Rows scraped so far are in {out.part}")
         import traceback
         traceback.print_exc()
         return {"success": False, "message": f"Scrape failed: {str(e)}"}
+    finally:
+        if out is not None:
+            out.close()
+
+
+def _run_incremental(category_url: str, csv_path: Path, image_dir: Path, state_path: Path,
+                     delta_path: Path, engine: str = "threads") -> Dict[str, Any]:
+    start_time = time.time()
+    state = CrawlState(state_path)
+    delta = None
+    
+    try:
+        logger.info(f"Starting incremental granite scrape for {category_url}")
+        image_dir.mkdir(parents=True, exist_ok=True)
+        session = create_session()
+        
+        # Step 1+2: Listing pages are always fetched (they tell us what exists now);
+        # each product is conditionally fetched as soon as its listing page is parsed.
+        # Every finished product is already in the crawl state, so a crashed run resumes cheaply.
+        logger.info(f"Step 1: Crawling listing pages and checking products ({engine} engine)...")
+        listing = ListingCrawl(category_url)
+        delta = CsvStream(delta_path, ["change"] + FIELDNAMES)
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "failed": 0, "removed": 0}
+        
+        def on_result(url: str, record: Optional[Dict[str, str]], status: str) -> None:
+            counts[status] += 1
+            if status in ("added", "updated"):
+                delta.write({"change": status, **record})
+        
+        _scrape_products(session, listing, image_dir, on_result, state, engine)
+        
+        product_urls = listing.urls
+        if not product_urls:
+            delta.discard()
+            logger.warning("No product URLs found")
+            return {"success": False, "message": "No product URLs found"}
+        
+        # Products that disappeared from the listing (only trust a fully crawled listing)
+        listed = set(product_urls)
+        removed = [u for u in state.page_urls() if u not in listed] if listing.complete else []
+        if not listing.complete:
+            logger.warning("Listing crawl incomplete, not removing any products")
+        if removed:
+            for url in removed:
+                entry = state.get_page(url)
+                if entry and entry["record"]:
+                    delta.write({"change": "removed", **entry["record"]})
+            state.remove_pages(removed)
+            counts["removed"] = len(removed)
+        
+        # Step 3: Delta CSV always; full CSV only when the catalog actually changed
+        logger.info("Step 3: Saving delta...")
+        changed = delta.count
+        delta.commit()
+        
+        def catalog_rows() -> Iterator[Dict[str, str]]:
+            for url in product_urls:
+                entry = state.get_page(url)
+                if entry and entry["record"]:
+                    yield entry["record"]
+            if not listing.complete:
+                # Keep products from listing pages we could not reach this time
+                for record in state.records():
+                    if record["product_url"] not in listed:
+                        yield record
+        
+        if changed or not csv_path.exists():
+            count = write_csv(csv_path, catalog_rows())
+            logger.info(f"Catalog changed, rewrote {csv_path} ({count} rows)")
+        else:
+            count = sum(1 for _ in catalog_rows())
+            logger.info("No changes, catalog CSV left untouched")
+        
+        elapsed_time = time.time() - start_time
+        logger.info(f"Incremental scrape done in {elapsed_time:.2f} seconds: {counts}")
+        
+        return {
+            "success": True,
+            "message": f"Checked {len(product_urls)} products in {elapsed_time:.2f} seconds ({changed} changed)",
+            "count": count,
+            "changes": counts,
+            "csv_path": str(csv_path),
+            "delta_path": str(delta_path),
+            "image_dir": str(image_dir),
+            "elapsed_time": round(elapsed_time, 2)
+        }
+    
+    except Exception as e:
+        logger.error(f"Scrape failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"success": False, "message": f"Scrape failed: {str(e)}"}
+    finally:
+        if delta is not None:
+            delta.close()
+        state.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Siamtak granite scraper")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep a crawl state and only re-fetch/rewrite what changed since the last run")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="threads = ThreadPoolExecutor, async = aiohttp with per-host pools")
+    parser.add_argument("--parser", choices=list(fast_parser.BACKENDS), default="fast",
+                        help="fast = lxml extraction spec with BeautifulSoup fallback, bs4 = heuristics only")
+    args = parser.parse_args()
+    
+    fast_parser.set_backend(args.parser)
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s'
@@ -363,7 +812,7 @@ if __name__ == "__main__":
     print("Fast Granite Scraper - Siamtak.com")
     print("=" * 60)
     
-    res = run_granite_scrape()
+    res = run_granite_scrape(incremental=args.incremental, engine=args.engine)
     
     print("\n" + "=" * 60)
     print("Scrape Result:")
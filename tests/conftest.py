@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# module ของแอปอยู่ที่ root ของ repo (ไม่ได้เป็น package)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,238 @@
+"""GeminiClient แบบ offline: fake model แทน genai.GenerativeModel (ไม่ต้องมี API key / network)"""
+import asyncio
+
+import pytest
+
+import gemini_client
+from gemini_client import GeminiClient, retry_after_seconds
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    def __init__(self, chunks: list[str]):
+        self._chunks = list(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._chunks:
+            raise StopAsyncIteration
+        await asyncio.sleep(0)
+        return FakeResponse(self._chunks.pop(0))
+
+
+class ApiError(Exception):
+    def __init__(self, message: str, retry_after=None):
+        super().__init__(message)
+        if retry_after is not None:
+            self.retry_after = retry_after
+
+
+class FakeModel:
+    """
+    generate_content_async แบบเดียวกับ genai.GenerativeModel
+    failures: exception ที่จะ raise ตามลำดับก่อนตอบสำเร็จ, gate: รอ event ก่อนตอบ (ใช้ทดสอบ coalesce)
+    """
+
+    def __init__(self, text: str = "ok", failures=(), gate: asyncio.Event | None = None):
+        self.text = text
+        self.failures = list(failures)
+        self.gate = gate
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.failures:
+            raise self.failures.pop(0)
+        if stream:
+            return FakeStream([self.text[:2], self.text[2:]])
+        return FakeResponse(self.text)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """เก็บเวลาที่ client สั่งรอ (backoff) แทนการรอจริง"""
+    recorded = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        recorded.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(gemini_client.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(gemini_client.random, "random", lambda: 0.0)  # ไม่มี jitter
+    return recorded
+
+
+def make_client(model, **kwargs) -> GeminiClient:
+    kwargs.setdefault("requests_per_minute", 60_000)
+    return GeminiClient(model, **kwargs)
+
+
+# ----------------------------------------------------------------------
+# retry / Retry-After
+# ----------------------------------------------------------------------
+def test_retry_after_from_error_attribute_header_and_message():
+    assert retry_after_seconds(ApiError("429", retry_after="3")) == 3.0
+
+    class Resp:
+        headers = {"Retry-After": "7"}
+
+    e = ApiError("429 Resource exhausted")
+    e.response = Resp()
+    assert retry_after_seconds(e) == 7.0
+    assert retry_after_seconds(ApiError("429 quota exceeded, please retry in 12.5s")) == 12.5
+    assert retry_after_seconds(ApiError("503 unavailable")) is None
+
+
+def test_rate_limited_call_waits_retry_after_then_succeeds(sleeps):
+    model = FakeModel("hello", failures=[ApiError("429 Resource exhausted", retry_after="2")])
+    client = make_client(model)
+
+    assert asyncio.run(client.generate("q")) == "hello"
+    assert model.calls == 2
+    assert sleeps == [2.0]  # ใช้เวลาที่ server บอก ไม่ใช่ backoff ของเราเอง
+
+
+def test_server_error_uses_exponential_backoff(sleeps):
+    model = FakeModel("hello", failures=[ApiError("503 unavailable"), ApiError("503 unavailable")])
+    client = make_client(model, base_backoff=1.0)
+
+    assert asyncio.run(client.generate("q")) == "hello"
+    assert model.calls == 3
+    assert sleeps == [0.5, 1.0]  # base * 2**attempt * 0.5 (jitter = 0)
+
+
+def test_gives_up_after_max_retries(sleeps):
+    model = FakeModel(failures=[ApiError("429")] * 5)
+    client = make_client(model, max_retries=3)
+
+    with pytest.raises(ApiError):
+        asyncio.run(client.generate("q"))
+    assert model.calls == 3
+
+
+def test_non_retryable_error_is_raised_immediately(sleeps):
+    model = FakeModel(failures=[ValueError("400 invalid argument")])
+    client = make_client(model)
+
+    with pytest.raises(ValueError):
+        asyncio.run(client.generate("q"))
+    assert model.calls == 1
+    assert sleeps == []
+
+
+def test_timeout_is_retried(sleeps):
+    class SlowOnce(FakeModel):
+        async def generate_content_async(self, prompt, stream=False):
+            self.calls += 1
+            if self.calls == 1:
+                await asyncio.Event().wait()  # ไม่ตอบเลย -> timeout
+            return FakeResponse("late")
+
+    model = SlowOnce()
+    client = make_client(model, timeout=0.05)
+
+    assert asyncio.run(client.generate("q")) == "late"
+    assert model.calls == 2
+
+
+def test_stream_retries_before_first_chunk(sleeps):
+    model = FakeModel("hello", failures=[ApiError("503 unavailable")])
+    client = make_client(model)
+
+    async def collect():
+        return [t async for t in client.stream("q")]
+
+    assert "".join(asyncio.run(collect())) == "hello"
+    assert model.calls == 2
+
+
+# ----------------------------------------------------------------------
+# coalescing (single-flight)
+# ----------------------------------------------------------------------
+def test_identical_concurrent_prompts_share_one_call():
+    async def run():
+        gate = asyncio.Event()
+        model = FakeModel("shared", gate=gate)
+        client = make_client(model)
+        tasks = [asyncio.ensure_future(client.generate("same prompt")) for _ in range(5)]
+        await asyncio.sleep(0)
+        gate.set()
+        return model, client, await asyncio.gather(*tasks)
+
+    model, client, answers = asyncio.run(run())
+    assert answers == ["shared"] * 5
+    assert model.calls == 1
+    assert client.coalesced == 4
+
+
+def test_different_prompt_or_model_is_not_coalesced():
+    async def run():
+        gate = asyncio.Event()
+        model, other = FakeModel("a", gate=gate), FakeModel("b", gate=gate)
+        client = make_client(model)
+        tasks = [
+            asyncio.ensure_future(client.generate("p1")),
+            asyncio.ensure_future(client.generate("p2")),
+            asyncio.ensure_future(client.generate("p1", model=other)),
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        return model, other, client, await asyncio.gather(*tasks)
+
+    model, other, client, answers = asyncio.run(run())
+    assert answers == ["a", "a", "b"]
+    assert (model.calls, other.calls, client.coalesced) == (2, 1, 0)
+
+
+def test_error_is_shared_and_next_call_starts_fresh():
+    async def run():
+        gate = asyncio.Event()
+        model = FakeModel("ok", failures=[ValueError("400 bad request")], gate=gate)
+        client = make_client(model)
+        tasks = [asyncio.ensure_future(client.generate("q")) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return model, results, await client.generate("q")
+
+    model, results, again = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert again == "ok"
+    assert model.calls == 2
+
+
+def test_identical_concurrent_streams_share_one_call():
+    async def run():
+        gate = asyncio.Event()
+        model = FakeModel("streamed", gate=gate)
+        client = make_client(model)
+
+        async def collect():
+            return "".join([t async for t in client.stream("same prompt")])
+
+        tasks = [asyncio.ensure_future(collect()) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        return model, client, await asyncio.gather(*tasks)
+
+    model, client, texts = asyncio.run(run())
+    assert texts == ["streamed"] * 3
+    assert model.calls == 1
+    assert client.coalesced == 2
+
+
+def test_sync_bridge_from_plain_thread():
+    model = FakeModel("hello")
+    client = make_client(model)
+
+    assert client.generate_sync("q") == "hello"
+    assert "".join(client.stream_sync("q2")) == "hello"
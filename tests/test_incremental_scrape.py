@@ -0,0 +1,216 @@
+"""
+Incremental scraping against a local fixture shop (no network): conditional GETs,
+304 handling, change detection and the delta CSV, for both crawl engines.
+"""
+import csv
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scrape_granite
+from crawl_state import CrawlState, conditional_headers
+
+PRODUCTS = 12
+PER_PAGE = 5
+
+
+class Shop(ThreadingHTTPServer):
+    """Paginated category listing, product pages and images; counts what it served."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ShopHandler)
+        self.prices = {f"p{i}": 1000 + i for i in range(PRODUCTS)}
+        self.etags = True
+        self.hits = {"page": 0, "image": 0, "304": 0, "conditional": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.hits[name] += 1
+
+
+class ShopHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: bytes, etag: str | None = None, content_type: str = "text/html; charset=utf-8"):
+        if etag and self.server.etags and self.headers.get("If-None-Match") == etag:
+            self.server.count("304")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag and self.server.etags:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        shop = self.server
+        if self.headers.get("If-None-Match"):
+            shop.count("conditional")
+        path = self.path
+        if path.startswith("/sub-category/granite"):
+            page = int(path.split("page=")[1]) if "page=" in path else 1
+            slugs = list(shop.prices)[(page - 1) * PER_PAGE:page * PER_PAGE]
+            links = "".join(f'<a href="/products/{s}">{s}</a>' for s in slugs)
+            more = page * PER_PAGE < len(shop.prices)
+            nav = f'<nav class="pagination"><a href="/sub-category/granite?page={page + 1}">Next</a></nav>' if more else ""
+            return self._send(f"<html><body>{links}{nav}</body></html>".encode())
+        if path.startswith("/products/"):
+            slug = path.rsplit("/", 1)[-1]
+            if slug not in shop.prices:
+                self.send_response(404)
+                self.end_headers()
+                return
+            price = shop.prices[slug]
+            body = (
+                f'<html><head><meta name="description" content="Granite slab {slug} for kitchen tops">'
+                f'<meta property="og:image" content="{shop.base}/img/{slug}.jpg"></head>'
+                f'<body><h1>{slug.upper()}</h1><div class="product_price">{price}</div></body></html>'
+            ).encode()
+            if self.headers.get("If-None-Match") != f'"{slug}-{price}"':
+                shop.count("page")
+            return self._send(body, f'"{slug}-{price}"')
+        if path.startswith("/img/"):
+            if not self.headers.get("If-None-Match"):
+                shop.count("image")
+            return self._send(b"\xff\xd8" + path.encode() * 100, '"img"', "image/jpeg")
+        self.send_response(404)
+        self.end_headers()
+
+
+@pytest.fixture
+def shop():
+    server = Shop()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["threads", "async"])
+def scrape(request, shop, tmp_path):
+    paths = {
+        "csv_path": tmp_path / "granite.csv",
+        "image_dir": tmp_path / "img",
+        "state_path": tmp_path / "state.sqlite3",
+        "delta_path": tmp_path / "delta.csv",
+    }
+
+    def run(**kwargs):
+        kwargs = {"incremental": True, **paths, **kwargs}
+        result = scrape_granite.run_granite_scrape(
+            category_url=f"{shop.base}/sub-category/granite", engine=request.param, **kwargs
+        )
+        assert result["success"], result
+        return result
+
+    run.paths = paths
+    return run
+
+
+def read_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_conditional_headers_from_state_entry():
+    assert conditional_headers(None) == {}
+    assert conditional_headers({"etag": '"a"', "last_modified": None}) == {"If-None-Match": '"a"'}
+    assert conditional_headers({"etag": None, "last_modified": "Tue, 01 Jul 2025 00:00:00 GMT"}) == {
+        "If-Modified-Since": "Tue, 01 Jul 2025 00:00:00 GMT"
+    }
+
+
+def test_first_run_adds_everything(scrape, shop):
+    result = scrape()
+
+    assert result["count"] == PRODUCTS
+    assert result["changes"] == {"added": PRODUCTS, "updated": 0, "unchanged": 0, "failed": 0, "removed": 0}
+    assert shop.hits["page"] == PRODUCTS and shop.hits["image"] == PRODUCTS
+    rows = read_csv(scrape.paths["csv_path"])
+    assert {r["product_price"] for r in rows} == {str(p) for p in shop.prices.values()}
+    assert all(r["image_path"] for r in rows)
+    assert len([p for p in scrape.paths["image_dir"].rglob("*") if p.is_file()]) == PRODUCTS
+    assert len(read_csv(scrape.paths["delta_path"])) == PRODUCTS
+
+
+def test_unchanged_pages_come_back_as_304(scrape, shop):
+    scrape()
+    csv_mtime = scrape.paths["csv_path"].stat().st_mtime_ns
+    shop.hits.update(page=0, image=0)
+
+    result = scrape()
+
+    assert result["changes"]["unchanged"] == PRODUCTS
+    assert shop.hits["304"] == PRODUCTS  # every product page revalidated, none re-downloaded
+    assert shop.hits["page"] == 0 and shop.hits["image"] == 0
+    assert scrape.paths["csv_path"].stat().st_mtime_ns == csv_mtime  # catalog CSV left untouched
+    assert read_csv(scrape.paths["delta_path"]) == []
+
+
+def test_changed_page_is_refetched_and_in_delta(scrape, shop):
+    scrape()
+    shop.prices["p3"] = 4321
+
+    result = scrape()
+
+    assert result["changes"]["updated"] == 1 and result["changes"]["unchanged"] == PRODUCTS - 1
+    delta = read_csv(scrape.paths["delta_path"])
+    assert [(r["change"], r["product_url"].rsplit("/", 1)[-1], r["product_price"]) for r in delta] == [
+        ("updated", "p3", "4321")
+    ]
+    prices = {r["product_url"].rsplit("/", 1)[-1]: r["product_price"] for r in read_csv(scrape.paths["csv_path"])}
+    assert prices["p3"] == "4321"
+
+
+def test_removed_product_is_dropped(scrape, shop):
+    scrape()
+    del shop.prices["p0"]
+
+    result = scrape()
+
+    assert result["changes"]["removed"] == 1
+    assert result["count"] == PRODUCTS - 1
+    assert [r["change"] for r in read_csv(scrape.paths["delta_path"])] == ["removed"]
+    state = CrawlState(scrape.paths["state_path"])
+    try:
+        assert not any(u.endswith("/p0") for u in state.page_urls())
+    finally:
+        state.close()
+
+
+def test_without_validators_unchanged_body_is_detected_by_hash(scrape, shop):
+    shop.etags = False
+    scrape()
+    csv_mtime = scrape.paths["csv_path"].stat().st_mtime_ns
+
+    result = scrape()
+
+    assert result["changes"]["unchanged"] == PRODUCTS
+    assert shop.hits["304"] == 0 and shop.hits["conditional"] == 0
+    assert scrape.paths["csv_path"].stat().st_mtime_ns == csv_mtime
+
+
+def test_default_is_a_full_scrape_without_state(shop, tmp_path):
+    result = scrape_granite.run_granite_scrape(
+        category_url=f"{shop.base}/sub-category/granite", csv_path=tmp_path / "granite.csv",
+        image_dir=tmp_path / "img", state_path=tmp_path / "state.sqlite3", delta_path=tmp_path / "delta.csv",
+    )
+
+    assert result["success"] and result["count"] == PRODUCTS
+    assert "changes" not in result
+    assert not (tmp_path / "state.sqlite3").exists() and not (tmp_path / "delta.csv").exists()
+    assert shop.hits["conditional"] == 0
@@ -0,0 +1,88 @@
+"""ResponseCache (SQLite) กับนาฬิกาปลอม: hit/miss, ttl, จำกัดจำนวน, bypass, อยู่ข้าม restart"""
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key, normalize_question
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+
+    def tick(seconds: float = 1.0) -> None:
+        now[0] += seconds
+
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    return tick
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "responses.sqlite3")
+
+
+def test_key_ignores_case_and_whitespace_but_not_context_or_model():
+    assert normalize_question("  Granite   สีดำ \n") == "granite สีดำ"
+    key = make_cache_key("m", "v1", "Granite สีดำ")
+    assert key == make_cache_key("m", "v1", "  granite   สีดำ ")
+    assert key != make_cache_key("m", "v2", "granite สีดำ")
+    assert key != make_cache_key("other", "v1", "granite สีดำ")
+
+
+def test_hit_and_miss(db, clock):
+    cache = ResponseCache(db)
+    assert cache.get("k") is None
+    cache.put("k", "m", "answer")
+    assert cache.get("k") == "answer"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "bypass": False}
+
+
+def test_empty_answer_is_not_cached(db, clock):
+    cache = ResponseCache(db)
+    cache.put("k", "m", "")
+    assert cache.get("k") is None
+
+
+def test_entry_expires_after_ttl(db, clock):
+    cache = ResponseCache(db, ttl=60)
+    cache.put("k", "m", "answer")
+    clock(59)
+    assert cache.get("k") == "answer"
+    clock(2)
+    assert cache.get("k") is None
+    assert cache.stats()["size"] == 0  # ตัวที่หมดอายุถูกลบตอนอ่าน
+
+
+def test_purge_expired(db, clock):
+    cache = ResponseCache(db, ttl=60)
+    cache.put("old", "m", "a")
+    clock(100)
+    cache.put("new", "m", "b")
+    assert cache.purge_expired() == 1
+    assert cache.get("new") == "b"
+
+
+def test_keeps_most_recently_used_entries(db, clock):
+    cache = ResponseCache(db, max_entries=2)
+    cache.put("a", "m", "1")
+    clock()
+    cache.put("b", "m", "2")
+    clock()
+    assert cache.get("a") == "1"  # a ถูกใช้ล่าสุด -> b เก่าสุด
+    clock()
+    cache.put("c", "m", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_bypass_never_reads_or_writes(db, clock):
+    cache = ResponseCache(db, bypass=True)
+    cache.put("k", "m", "answer")
+    assert cache.get("k") is None
+    assert ResponseCache(db).get("k") is None
+
+
+def test_survives_restart(db, clock):
+    ResponseCache(db).put("k", "m", "answer")
+    assert ResponseCache(db).get("k") == "answer"